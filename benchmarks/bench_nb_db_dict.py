@@ -0,0 +1,375 @@
+# coding=utf8
+"""
+nb_db_dict 性能基准测试，离线运行，只需要 SQLite（文件数据库和内存数据库各跑一遍）
+
+测量：
+    insert 逐条 / insert_many / insert_many 单事务 / buffered 缓冲写入 / insert_columns 列式 / bulk_load
+    upsert 逐条 / upsert_many，find_one 逐条 / get_many / find 全表 / find_iter / scan
+    大量新键的表结构演进（自动加列）
+    dataset_lib.get_table 作为对照（未安装 dataset 时跳过）
+
+用法：
+    python benchmarks/bench_nb_db_dict.py                                  # 结果 JSON 打印到标准输出
+    python benchmarks/bench_nb_db_dict.py --rows 5000 --output result.json
+    python benchmarks/bench_nb_db_dict.py --baseline last.json --check     # 和上次结果比较，退步超过阈值时退出码为 1
+
+回归阈值在 benchmarks/thresholds.json：
+    ratios          同一次运行中两项的吞吐量之比（与机器无关），例如 insert_many 至少是 insert 的 N 倍
+    max_regression  和 --baseline 结果相比，吞吐量下降超过这个比例就算退步
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+
+from db_libs.nb_db_dict import Database
+
+THRESHOLDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thresholds.json')
+
+
+class Backend:
+    """一个 SQLite 后端：file 是临时文件数据库，memory 是内存数据库；每项基准使用全新的数据库"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self._path: Optional[str] = None
+        self._db: Optional[Database] = None
+    
+    def open(self) -> Database:
+        if self.name == 'memory':
+            # 内存数据库所有线程共用一个连接，buffered 的后台线程才能看到同一个库
+            self._db = Database('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+        else:
+            fd, self._path = tempfile.mkstemp(suffix='.db', prefix='bench_nb_db_dict_')
+            os.close(fd)
+            self._db = Database(f'sqlite:///{self._path}')
+        return self._db
+    
+    @property
+    def url(self) -> str:
+        return f'sqlite:///{self._path}' if self._path else 'sqlite://'
+    
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self._path and os.path.exists(self._path):
+            try:
+                os.remove(self._path)
+            except PermissionError:
+                pass
+        self._path = None
+
+
+def make_rows(n: int, start: int = 0) -> List[Dict]:
+    return [{'code': f'{i:08d}', 'name': f'name_{i}', 'price': i * 0.01, 'volume': i, 'ok': i % 2 == 0}
+            for i in range(start, start + n)]
+
+
+# 每个基准函数：准备数据（不计时）后返回一个计时函数，计时函数返回处理的行数
+def bench_insert(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table = db['t']
+    rows = make_rows(n)
+    
+    def run():
+        for row in rows:
+            table.insert(row)
+        return len(rows)
+    return run
+
+
+def bench_insert_many(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table = db['t']
+    rows = make_rows(n)
+    return lambda: table.insert_many(rows)
+
+
+def bench_insert_many_single_tx(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table = db['t']
+    rows = make_rows(n)
+    return lambda: table.insert_many(rows, single_transaction=True)
+
+
+def bench_buffered(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table = db['t']
+    rows = make_rows(n)
+    
+    def run():
+        with table.buffered(max_rows=1000, max_delay=0.05) as writer:
+            for row in rows:
+                writer.insert(row)
+        return len(rows)
+    return run
+
+
+def bench_insert_columns(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    import numpy as np
+    table = db['t']
+    columns = {
+        'code': [f'{i:08d}' for i in range(n)],
+        'price': np.arange(n) * 0.01,
+        'volume': np.arange(n, dtype=np.int64),
+        'ok': np.arange(n) % 2 == 0,
+    }
+    return lambda: table.insert_columns(columns)
+
+
+def bench_bulk_load(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table = db['t']
+    rows = make_rows(n)
+    return lambda: table.bulk_load(rows)
+
+
+def _prepare_upsert(db: Database, n: int):
+    table = db['t']
+    table.insert_many(make_rows(n))
+    table.create_index('code', unique=True)
+    return table, [{**row, 'price': row['price'] + 1} for row in make_rows(n, start=n // 2)]
+
+
+def bench_upsert(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table, rows = _prepare_upsert(db, n)
+    
+    def run():
+        for row in rows:
+            table.upsert(row, keys=['code'])
+        return len(rows)
+    return run
+
+
+def bench_upsert_many(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table, rows = _prepare_upsert(db, n)
+    return lambda: table.upsert_many(rows, keys=['code'])
+
+
+def _prepare_read(db: Database, n: int):
+    table = db['t']
+    table.insert_many(make_rows(n))
+    table.create_index('code')
+    return table
+
+
+def bench_find_one(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table = _prepare_read(db, n)
+    codes = [f'{i:08d}' for i in range(0, n, 3)]
+    
+    def run():
+        for code in codes:
+            table.find_one(code=code)
+        return len(codes)
+    return run
+
+
+def bench_get_many(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table = _prepare_read(db, n)
+    codes = [f'{i:08d}' for i in range(0, n, 3)]
+    return lambda: len(table.get_many('code', codes))
+
+
+def bench_find_all(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table = _prepare_read(db, n)
+    return lambda: len(table.find())
+
+
+def bench_find_all_rows(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table = _prepare_read(db, n)
+    return lambda: len(table.find(_as='row'))
+
+
+def bench_find_iter(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table = _prepare_read(db, n)
+    return lambda: sum(1 for _ in table.find_iter(_batch_size=1000))
+
+
+def bench_scan(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    table = _prepare_read(db, n)
+    return lambda: sum(len(batch) for batch in table.scan(_batch_size=1000))
+
+
+def bench_schema_evolution(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    """每行都带一个新键，测量自动加列的开销（新列数为 n/100，最多 500 列）"""
+    table = db['t']
+    new_keys = min(max(n // 100, 10), 500)
+    rows = [{'code': f'{i:08d}', f'extra_{i % new_keys}': i} for i in range(n)]
+    return lambda: table.insert_many(rows, chunk_size=new_keys)
+
+
+def bench_dataset_insert_many(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    """对照组：dataset 库的 insert_many"""
+    from db_libs import dataset_lib
+    if backend.name == 'memory':
+        raise SkipBenchmark('dataset 的内存数据库每个连接是独立的库，只测文件数据库')
+    table = dataset_lib.get_table(backend.url, 't')
+    rows = make_rows(n)
+    return lambda: table.insert_many(rows) or len(rows)
+
+
+def bench_dataset_upsert(db: Database, backend: Backend, n: int) -> Callable[[], int]:
+    """对照组：dataset 库逐条 upsert"""
+    from db_libs import dataset_lib
+    if backend.name == 'memory':
+        raise SkipBenchmark('dataset 的内存数据库每个连接是独立的库，只测文件数据库')
+    _prepare_upsert(db, n)
+    table = dataset_lib.get_table(backend.url, 't')
+    rows = [{**row, 'price': row['price'] + 1} for row in make_rows(n, start=n // 2)]
+    
+    def run():
+        for row in rows:
+            table.upsert(row, keys=['code'])
+        return len(rows)
+    return run
+
+
+class SkipBenchmark(Exception):
+    """基准不适用于当前环境（缺少可选依赖等）"""
+
+
+# (名称, 基准函数, 行数相对 --rows 的比例)；逐条操作的基准用较少的行数
+BENCHMARKS = [
+    ('insert', bench_insert, 0.1),
+    ('insert_many', bench_insert_many, 1),
+    ('insert_many_single_tx', bench_insert_many_single_tx, 1),
+    ('buffered', bench_buffered, 1),
+    ('insert_columns', bench_insert_columns, 1),
+    ('bulk_load', bench_bulk_load, 1),
+    ('upsert', bench_upsert, 0.1),
+    ('upsert_many', bench_upsert_many, 1),
+    ('find_one', bench_find_one, 0.3),
+    ('get_many', bench_get_many, 1),
+    ('find_all', bench_find_all, 1),
+    ('find_all_rows', bench_find_all_rows, 1),
+    ('find_iter', bench_find_iter, 1),
+    ('scan', bench_scan, 1),
+    ('schema_evolution', bench_schema_evolution, 1),
+    ('dataset_insert_many', bench_dataset_insert_many, 1),
+    ('dataset_upsert', bench_dataset_upsert, 0.1),
+]
+
+
+def run_benchmark(backend: Backend, name: str, func: Callable, n: int, repeat: int) -> Dict[str, Any]:
+    """运行一项基准 repeat 次，取最快的一次"""
+    best: Optional[Dict[str, Any]] = None
+    for _ in range(repeat):
+        db = backend.open()
+        try:
+            run = func(db, backend, n)
+            start = time.perf_counter()
+            rows = run()
+            seconds = time.perf_counter() - start
+        except SkipBenchmark as e:
+            return {'skipped': str(e)}
+        except ImportError as e:
+            return {'skipped': f'缺少可选依赖: {e}'}
+        finally:
+            backend.close()
+        if best is None or seconds < best['seconds']:
+            best = {'rows': rows, 'seconds': round(seconds, 6),
+                    'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None}
+    return best
+
+
+def check_results(results: Dict[str, Dict[str, Dict]], thresholds: Dict[str, Any],
+                  baseline: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """按阈值检查结果，返回每项检查的结果"""
+    checks = []
+    for backend_name, backend_results in results.items():
+        for rule in thresholds.get('ratios', []):
+            faster = backend_results.get(rule['faster'], {})
+            slower = backend_results.get(rule['slower'], {})
+            if not faster.get('rows_per_sec') or not slower.get('rows_per_sec'):
+                continue
+            ratio = faster['rows_per_sec'] / slower['rows_per_sec']
+            checks.append({
+                'name': f"{backend_name}: {rule['faster']} / {rule['slower']} >= {rule['min_ratio']}",
+                'value': round(ratio, 2),
+                'passed': ratio >= rule['min_ratio'],
+            })
+    
+    if baseline is not None:
+        max_regression = thresholds.get('max_regression', 0.25)
+        for backend_name, backend_results in results.items():
+            for name, result in backend_results.items():
+                old = baseline.get('results', {}).get(backend_name, {}).get(name, {})
+                if not result.get('rows_per_sec') or not old.get('rows_per_sec'):
+                    continue
+                change = result['rows_per_sec'] / old['rows_per_sec'] - 1
+                checks.append({
+                    'name': f'{backend_name}: {name} 相比基线',
+                    'value': round(change, 3),
+                    'passed': change >= -max_regression,
+                })
+    return checks
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='nb_db_dict 性能基准测试（SQLite）')
+    parser.add_argument('--rows', type=int, default=20000, help='批量类基准的行数，逐条类基准按比例减少')
+    parser.add_argument('--repeat', type=int, default=3, help='每项运行次数，取最快的一次')
+    parser.add_argument('--backends', default='file,memory', help='逗号分隔：file、memory')
+    parser.add_argument('--only', default='', help='只运行这些基准，逗号分隔')
+    parser.add_argument('--output', help='结果 JSON 写入的文件，不传则打印到标准输出')
+    parser.add_argument('--baseline', help='用于比较的上次结果 JSON')
+    parser.add_argument('--thresholds', default=THRESHOLDS_FILE, help='回归阈值 JSON')
+    parser.add_argument('--check', action='store_true', help='有检查不通过时退出码为 1')
+    args = parser.parse_args(argv)
+    
+    only = {name for name in args.only.split(',') if name}
+    results: Dict[str, Dict[str, Dict]] = {}
+    for backend_name in args.backends.split(','):
+        backend = Backend(backend_name)
+        results[backend_name] = {}
+        for name, func, scale in BENCHMARKS:
+            if only and name not in only:
+                continue
+            n = max(int(args.rows * scale), 10)
+            result = run_benchmark(backend, name, func, n, args.repeat)
+            results[backend_name][name] = result
+            print(f'{backend_name:6s} {name:24s} {result}', file=sys.stderr)
+    
+    with open(args.thresholds, encoding='utf8') as f:
+        thresholds = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as f:
+            baseline = json.load(f)
+    checks = check_results(results, thresholds, baseline)
+    
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'sqlite': sqlite3.sqlite_version,
+            'rows': args.rows,
+            'repeat': args.repeat,
+        },
+        'results': results,
+        'checks': checks,
+        'passed': all(check['passed'] for check in checks),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            f.write(text)
+    else:
+        print(text)
+    
+    for check in checks:
+        if not check['passed']:
+            print(f"未通过: {check['name']} (实际 {check['value']})", file=sys.stderr)
+    return 0 if report['passed'] or not args.check else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,12 +9,24 @@
 这种方式需要能看懂源码。
 
 """
+import collections
 import datetime
+import itertools
+import os
+import queue
+import random
+import re
+import threading
+import time
+import weakref
 import nb_log
 import pymysql
 import pymysql.cursors
 from dbutils.pooled_db  import PooledDB  # pip install DBUtils
 import decorator_libs
+from db_libs.slots_row import make_row_class
+
+logger = nb_log.LogManager('db_libs.mysql_lib').get_logger_and_add_handlers()
 
 
 class _Row(dict):
@@ -27,19 +39,196 @@ class _Row(dict):
             raise AttributeError(name)
 
 
-class ObjectCusor(pymysql.cursors.DictCursor, ):
+class QueryTracer:
+    """
+    sql 耗时统计和慢查询日志。
+    每条 sql 只记录耗时和行数，按语句指纹（把字面量、占位符替换成 ? 后的 sql）在内存中汇总，
+    只有慢查询（耗时超过 slow_threshold）和按 sample_rate 抽样的 sql 才会拼接完整 sql 写日志，
+    不再每条 sql 都格式化字符串、写文件。
+    """
+    logger = nb_log.LogManager('db_libs.ObjectCusor').get_logger_and_add_handlers(log_filename='ObjectCusor.log')
+
+    _RE_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'" r'|"(?:[^"\\]|\\.|"")*"')
+    _RE_PLACEHOLDER = re.compile(r'%\([^)]+\)s|%s')
+    _RE_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+    _RE_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+    _RE_VALUES_LIST = re.compile(r'(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+')
+    _RE_SPACE = re.compile(r'\s+')
+
+    def __init__(self, slow_threshold=1.0, sample_rate=0.0, max_fingerprints=1000, max_samples=1000):
+        """
+        :param slow_threshold: 慢查询阈值（秒），耗时超过它的 sql 以 warning 级别写日志，None 表示不记慢查询日志
+        :param sample_rate: 抽样写日志的比例，0 到 1，抽中的 sql 以 debug 级别写日志
+        :param max_fingerprints: 最多汇总多少种语句指纹，超过后新的指纹都汇总到 '<other>'
+        :param max_samples: 每种指纹保留最近多少次的耗时用于计算 p50/p99
+        """
+        self.slow_threshold = slow_threshold
+        self.sample_rate = sample_rate
+        self.max_fingerprints = max_fingerprints
+        self.max_samples = max_samples
+        self._stats = {}
+        self._fingerprint_cache = {}
+        self._lock = threading.Lock()
+
+    def fingerprint(self, query):
+        """
+        语句指纹：去掉字面量和占位符、合并 IN 列表和多行 VALUES、压缩空白，
+        只是参数不同的 sql 指纹相同
+        """
+        if isinstance(query, (bytes, bytearray)):
+            query = bytes(query).decode('utf8', 'replace')
+        fp = self._fingerprint_cache.get(query)
+        if fp is None:
+            fp = self._RE_STRING.sub('?', query)
+            fp = self._RE_PLACEHOLDER.sub('?', fp)
+            fp = self._RE_NUMBER.sub('?', fp)
+            fp = self._RE_IN_LIST.sub('(...)', fp)
+            fp = self._RE_VALUES_LIST.sub(r'\1', fp)
+            fp = self._RE_SPACE.sub(' ', fp).strip()
+            if len(self._fingerprint_cache) >= 10000:
+                self._fingerprint_cache.clear()
+            self._fingerprint_cache[query] = fp
+        return fp
+
+    def record(self, cursor, query, args, elapsed, rows, error=False, many=False):
+        """
+        记录一次 execute/executemany
+
+        :param cursor: 执行 sql 的 cursor，写日志时用来拼接完整 sql
+        :param query: 未拼接参数的 sql
+        :param args: 参数，executemany 时是参数列表
+        :param elapsed: 耗时（秒）
+        :param rows: 影响/返回的行数
+        :param error: 是否抛出了异常
+        :param many: 是否是 executemany
+        """
+        fp = self.fingerprint(query)
+        with self._lock:
+            stat = self._stats.get(fp)
+            if stat is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    fp = '<other>'
+                    stat = self._stats.get(fp)
+                if stat is None:
+                    stat = self._stats[fp] = {'count': 0, 'errors': 0, 'rows': 0, 'total': 0.0, 'max': 0.0,
+                                              'samples': collections.deque(maxlen=self.max_samples)}
+            stat['count'] += 1
+            stat['errors'] += error
+            stat['rows'] += rows
+            stat['total'] += elapsed
+            stat['max'] = max(stat['max'], elapsed)
+            stat['samples'].append(elapsed)
+
+        is_slow = self.slow_threshold is not None and elapsed >= self.slow_threshold
+        if is_slow or (self.sample_rate and random.random() < self.sample_rate):
+            self.logger.log(30 if is_slow else 10, '%s耗时 %.3f 秒, 行数 %s: %s',
+                            '慢查询, ' if is_slow else '', elapsed, rows, self._full_sql(cursor, query, args, many))
+
+    @staticmethod
+    def _full_sql(cursor, query, args, many):
+        """拼接完整 sql，只在写日志时调用；executemany 只拼接第一组参数"""
+        if isinstance(query, (bytes, bytearray)):
+            return bytes(query).decode('utf8', 'replace')
+        try:
+            if many:
+                args = list(args)
+                return f'{cursor.mogrify(query, args[0])} (共 {len(args)} 组参数)'
+            return cursor.mogrify(query, args)
+        except Exception:  # 参数和 sql 不匹配时 execute 本身已经报错，日志里保留原始 sql
+            return f'{query} {args!r}'
+
+    @staticmethod
+    def _percentile(sorted_samples, q):
+        return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * q))]
+
+    def stats(self):
+        """
+        按总耗时从高到低返回每种语句指纹的统计，耗时单位为毫秒，p50/p99 基于最近 max_samples 次
+
+        :return: [{'fingerprint', 'count', 'errors', 'rows', 'total_ms', 'avg_ms', 'p50_ms', 'p99_ms', 'max_ms'}]
+        """
+        with self._lock:
+            items = [(fp, dict(stat, samples=sorted(stat['samples']))) for fp, stat in self._stats.items()]
+        result = []
+        for fp, stat in items:
+            result.append({
+                'fingerprint': fp,
+                'count': stat['count'],
+                'errors': stat['errors'],
+                'rows': stat['rows'],
+                'total_ms': round(stat['total'] * 1000, 3),
+                'avg_ms': round(stat['total'] * 1000 / stat['count'], 3),
+                'p50_ms': round(self._percentile(stat['samples'], 0.5) * 1000, 3),
+                'p99_ms': round(self._percentile(stat['samples'], 0.99) * 1000, 3),
+                'max_ms': round(stat['max'] * 1000, 3),
+            })
+        result.sort(key=lambda item: item['total_ms'], reverse=True)
+        return result
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self._stats.clear()
+
+
+default_tracer = QueryTracer()
+
+
+class _TracedCursorMixin:
+    """
+    execute/executemany 的耗时和行数记录到 tracer（QueryTracer），慢查询和抽样的 sql 写入 ObjectCusor.log。
+    tracer 为 None 时使用 CursorContext.tracer，CursorContext.tracer 也为 None 时不统计。
+    """
+    tracer = None
+    _in_executemany = False
+
+    @staticmethod
+    def _affected_rows(rowcount):
+        # 无缓冲的 cursor 在读完之前 rowcount 是 -1 或 2**64-1，不计入行数
+        return rowcount if 0 <= rowcount < 2 ** 63 else 0
+
+    def _get_tracer(self):
+        return self.tracer if self.tracer is not None else CursorContext.tracer
+
+    def execute(self, query, args=None):
+        tracer = self._get_tracer()
+        if tracer is None or self._in_executemany:  # executemany 内部的 execute 由 executemany 统一记录
+            return super().execute(query, args)
+        start = time.perf_counter()
+        error = True
+        try:
+            result = super().execute(query, args)
+            error = False
+            return result
+        finally:
+            tracer.record(self, query, args, time.perf_counter() - start,
+                          0 if error else self._affected_rows(self.rowcount), error)
+
+    def executemany(self, query, args):
+        tracer = self._get_tracer()
+        if tracer is None or not args:
+            return super().executemany(query, args)
+        start = time.perf_counter()
+        error = True
+        self._in_executemany = True
+        try:
+            result = super().executemany(query, args)
+            error = False
+            return result
+        finally:
+            self._in_executemany = False
+            tracer.record(self, query, args, time.perf_counter() - start,
+                          0 if error else self._affected_rows(self.rowcount), error, many=True)
+
+
+class ObjectCusor(_TracedCursorMixin, pymysql.cursors.DictCursor, ):
     """
     比字典式的cursor，返回结果除了能用 ["xx"]来获取字段的值以外，还可以使用 .xx的方式获取字段的值。
 
-    将sql内容打印出来
+    sql 的耗时统计和慢查询日志见 _TracedCursorMixin。
     """
     dict_type = _Row
-    logger_object_cursor = nb_log.LogManager('db_libs.ObjectCusor').get_logger_and_add_handlers(log_filename='ObjectCusor.log')
-
-    def mogrify(self, query, args=None):
-        query_str = super().mogrify(query, args)
-        self.logger_object_cursor.debug(query_str)
-        return query_str
+    logger_object_cursor = QueryTracer.logger
 
     def get_one(self, query, args):
         """
@@ -54,18 +243,138 @@ class ObjectCusor(pymysql.cursors.DictCursor, ):
         return self.fetchone()
 
 
+class ObjectSSCusor(_TracedCursorMixin, pymysql.cursors.SSDictCursor):
+    """
+    无缓冲（流式）的 ObjectCusor，结果集不会一次性全部读到客户端内存，适合查询大表，行同样支持 .xx 访问。
+    注意：结果读完之前这个连接不能执行其他 sql；一般通过 CursorContext(pool, stream=True) 使用。
+    """
+    dict_type = _Row
+
+    def iter_batches(self, size=1000):
+        """
+        按批读取当前结果集，每批是 fetchmany(size) 的行列表
+
+        :param size: 每批的行数
+        """
+        while True:
+            rows = self.fetchmany(size)
+            if not rows:
+                return
+            yield rows
+
+
+class _SlotsRowCursorMixin:
+    """
+    每行不再创建一个 _Row 字典，而是用 slots_row.make_row_class 按列名生成的 tuple 子类直接包装原始行元组，
+    同一组列名只生成一次行类；row.name、row['name']、row[0] 都可以用，每行的内存和取数的 CPU 都少很多。
+    列名重复时和 DictCursor 一样，后出现的列名为 '表名.列名'
+    """
+    _row_class = None
+
+    def _do_get_result(self):
+        super()._do_get_result()
+        if self.description:
+            fields = []
+            for f in self._result.fields:
+                name = f.name
+                if name in fields:
+                    name = f.table_name + "." + name
+                fields.append(name)
+            self._row_class = make_row_class(fields)
+            if self._rows:
+                self._rows = list(map(self._row_class, self._rows))
+
+    def _conv_row(self, row):
+        if row is None:
+            return None
+        return self._row_class(row)
+
+
+class ObjectSlotsCusor(_SlotsRowCursorMixin, _TracedCursorMixin, pymysql.cursors.Cursor):
+    """行是紧凑的 tuple 子类（见 _SlotsRowCursorMixin）的 ObjectCusor，适合返回大量行的查询"""
+
+
+class ObjectSSSlotsCusor(_SlotsRowCursorMixin, _TracedCursorMixin, pymysql.cursors.SSCursor):
+    """行是紧凑的 tuple 子类的 ObjectSSCusor，流式查询大表"""
+    iter_batches = ObjectSSCusor.iter_batches
+
+
 class CursorContext:
-    def __init__(self, conn_pool: PooledDB, cursor_class=ObjectCusor, ):
+    tracer = default_tracer
+
+    def __init__(self, conn_pool: PooledDB, cursor_class=None, tracer=None, stream=False, batch_size=1000,
+                 compact_rows=False):
         """
         :param conn_pool: 连接池
+        :param cursor_class: cursor 类型，默认 ObjectCusor，stream=True 时默认 ObjectSSCusor，
+                             compact_rows=True 时对应为 ObjectSlotsCusor、ObjectSSSlotsCusor
+        :param tracer: 这个上下文中 sql 的统计对象，默认 CursorContext.tracer
+        :param stream: 流式查询大表，结果不全部读入内存，用 cursor.iter_batches() 或 ctx.batches() 按批读取。
+                       结果没读完就退出上下文（break 或异常）时，连接直接断开并在连接池中换成新连接，
+                       不会为了放回连接池而读完剩余的行；这个连接上未提交的修改会丢失，流式模式请只用来查询
+        :param batch_size: stream=True 时 batches() 每批的行数
+        :param compact_rows: 行使用按列名生成的 tuple 子类而不是 _Row 字典，同样支持 row.name 和 row['name']，
+                             省内存、取数更快；行不能修改，需要字典时用 row._asdict()
         """
+        if cursor_class is None:
+            if compact_rows:
+                cursor_class = ObjectSSSlotsCusor if stream else ObjectSlotsCusor
+            else:
+                cursor_class = ObjectSSCusor if stream else ObjectCusor
+        self.stream = stream
+        self.batch_size = batch_size
         self.conn = conn_pool.connection()  # type: pymysql.Connection
         self.cursor = self.conn.cursor(cursor_class)  # type: ObjectCusor                #pymysql.cursors.Cursor
+        if tracer is not None:
+            # 连接池返回的是包装过的 cursor，统计对象设置在真正的 pymysql cursor 上
+            getattr(self.cursor, '_cursor', self.cursor).tracer = tracer
+
+    @classmethod
+    def configure_tracer(cls, slow_threshold=1.0, sample_rate=0.0, **kwargs):
+        """
+        替换默认的 sql 统计对象，例如 CursorContext.configure_tracer(slow_threshold=0.2, sample_rate=0.01)
+        传 slow_threshold=None, sample_rate=0 则不写日志只统计；要完全关闭统计，设置 CursorContext.tracer = None
+        """
+        cls.tracer = QueryTracer(slow_threshold, sample_rate, **kwargs)
+        return cls.tracer
+
+    @classmethod
+    def query_stats(cls):
+        """默认 tracer 中各语句指纹的统计，见 QueryTracer.stats"""
+        return cls.tracer.stats() if cls.tracer is not None else []
 
     def __enter__(self) -> ObjectCusor:
         return self.cursor
 
+    def batches(self, size=None):
+        """按批读取当前结果集，见 ObjectSSCusor.iter_batches"""
+        return self.cursor.iter_batches(size or self.batch_size)
+
+    def _has_unread_result(self):
+        result = getattr(self.cursor, '_result', None)
+        return result is not None and getattr(result, 'unbuffered_active', False)
+
+    def _discard_connection(self):
+        """
+        无缓冲结果集没读完时，连接在读完之前不能执行其他命令，关闭 cursor 会把剩余的行全部读完。
+        所以先关闭底层的 pymysql 连接（只发 COM_QUIT，不读剩余的行），再把连接还给连接池；
+        连接池归还时 rollback 失败（reset=False 时是下次取出时 ping 失败）会自动换成一个新连接，不会把读了一半的连接交给别人
+        """
+        raw = getattr(self.conn, 'dbapi_connection', None)  # dbutils 3.2 起公开的底层连接
+        if raw is None:  # setup.py 固定的 dbutils 3.1.0 还没有 dbapi_connection
+            raw = getattr(getattr(self.conn, '_con', None), '_con', None)
+        if raw is not None:
+            if getattr(raw, 'open', True):
+                raw.close()
+            if getattr(raw, '_result', None) is not None:
+                raw._result = None  # SSCursor.close 只在结果集还挂在连接上时才去读剩余的行
+        self.cursor.close()
+        self.conn.close()
+
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.stream and self._has_unread_result():
+            self._discard_connection()
+            return False
         if exc_type:
             self.conn.rollback()
         else:
@@ -75,10 +384,283 @@ class CursorContext:
         return False
 
 
+def _quote_name(name):
+    """给表名/列名加反引号，'db.table' 分别加"""
+    return '.'.join('`%s`' % part.replace('`', '``') for part in name.split('.'))
+
+
+def bulk_insert(conn_pool: PooledDB, table, rows, columns=None, workers=1,
+                max_statement_bytes=16 * 1024 * 1024, tracer=None):
+    """
+    大批量插入。把 rows 拼成多行 INSERT ... VALUES (...),(...) 语句，每条语句的大小不超过服务端的
+    max_allowed_packet（也不超过 max_statement_bytes），每条语句单独提交，不会变成一个巨大的事务。
+    workers > 1 时在当前线程拼接语句，多个线程各自从连接池取一个连接并行执行。
+
+    注意：每条语句单独提交，中途出错时已经提交的语句不会回滚。
+
+    :param conn_pool: 连接池
+    :param table: 表名，可以是 'db.table'
+    :param rows: 字典或元组/列表的可迭代对象，可以是生成器，不会一次性全部读入内存
+    :param columns: 列名列表；为 None 时，字典行取第一行的键，元组行不指定列（按表的列顺序）
+    :param workers: 并行执行的连接数
+    :param max_statement_bytes: 每条语句的最大字节数
+    :param tracer: 记录每条语句耗时的 QueryTracer，默认 CursorContext.tracer
+    :return: {'rows': 插入行数, 'statements': 语句数, 'seconds': 耗时, 'rows_per_sec': 每秒行数}
+    """
+    start = time.perf_counter()
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return {'rows': 0, 'statements': 0, 'seconds': 0.0, 'rows_per_sec': 0.0}
+    rows = itertools.chain([first], rows)
+    if isinstance(first, dict):
+        columns = list(first) if columns is None else list(columns)
+        rows = ([row.get(column) for column in columns] for row in rows)
+    prefix = 'INSERT INTO %s%s VALUES ' % (
+        _quote_name(table), ' (%s)' % ', '.join(_quote_name(column) for column in columns) if columns else '')
+    template = prefix + '(...)'
+    tracer = tracer if tracer is not None else CursorContext.tracer
+
+    conn = conn_pool.connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT @@max_allowed_packet')
+        row = cursor.fetchone()
+    except Exception:
+        cursor.close()
+        conn.close()
+        raise
+    # 连接池的 cursorclass 可能是 DictCursor，这时返回的是字典
+    max_allowed_packet = next(iter(row.values())) if isinstance(row, dict) else row[0]
+    limit = min(max_allowed_packet, max_statement_bytes) - 1024  # 留出包头等开销
+    # 逐个值转义，和 pymysql 的 mogrify 一样：整个元组交给 escape 时字符串固定用反斜杠转义，
+    # 不管服务端是否开启了 NO_BACKSLASH_ESCAPES
+    escape = cursor.connection.escape
+    encoding = cursor.connection.encoding
+
+    def statements():
+        # 按字节数切分，单行就超过限制时单独成一条语句，由服务端报错
+        prefix_bytes = prefix.encode(encoding)
+        sql = bytearray(prefix_bytes)
+        count = 0
+        for row in rows:
+            value = ('(' + ','.join([escape(item) for item in row]) + ')').encode(encoding)
+            if count and len(sql) + len(value) + 1 > limit:
+                yield bytes(sql), count
+                sql = bytearray(prefix_bytes)
+                count = 0
+            if count:
+                sql += b','
+            sql += value
+            count += 1
+        if count:
+            yield bytes(sql), count
+
+    def execute(cursor_, conn_, sql, count):
+        begin = time.perf_counter()
+        error = True
+        try:
+            cursor_.execute(sql)
+            conn_.commit()
+            error = False
+        except Exception:
+            conn_.rollback()
+            raise
+        finally:
+            if tracer is not None:
+                tracer.record(cursor_, template, None, time.perf_counter() - begin, 0 if error else count, error)
+
+    inserted = 0
+    statement_count = 0
+    if workers <= 1:
+        try:
+            for sql, count in statements():
+                execute(cursor, conn, sql, count)
+                inserted += count
+                statement_count += 1
+        finally:
+            cursor.close()
+            conn.close()
+    else:
+        cursor.close()
+        conn.close()
+        tasks = queue.Queue(maxsize=workers * 2)  # 限制已拼接未执行的语句数，控制内存
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            nonlocal inserted, statement_count
+            worker_conn = worker_cursor = None
+            try:
+                worker_conn = conn_pool.connection()
+                worker_cursor = worker_conn.cursor()
+            except Exception as e:
+                errors.append(e)  # 取不到连接也要继续消费队列，否则拼接语句的线程会卡在 put 上
+            try:
+                while True:
+                    task = tasks.get()
+                    if task is None:
+                        return
+                    if errors:  # 已经出错，只消费不执行，让拼接语句的线程尽快结束
+                        continue
+                    try:
+                        execute(worker_cursor, worker_conn, *task)
+                    except Exception as e:
+                        errors.append(e)
+                        continue
+                    with lock:
+                        inserted += task[1]
+                        statement_count += 1
+            finally:
+                if worker_cursor is not None:
+                    worker_cursor.close()
+                if worker_conn is not None:
+                    worker_conn.close()
+
+        threads = [threading.Thread(target=worker, name=f'bulk_insert_{i}', daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for task in statements():
+                if errors:
+                    break
+                tasks.put(task)
+        finally:
+            for _ in threads:
+                tasks.put(None)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+    seconds = time.perf_counter() - start
+    report = {'rows': inserted, 'statements': statement_count, 'seconds': round(seconds, 3),
+              'rows_per_sec': round(inserted / seconds, 1) if seconds > 0 else 0.0}
+    logger.info(f'bulk_insert {table}: {inserted} 行, {statement_count} 条语句, {seconds:.2f} 秒, '
+                f'{report["rows_per_sec"]} 行/秒')
+    return report
+
+
+class MonitoredPooledDB(PooledDB):
+    """
+    带统计的 PooledDB：借出/空闲连接数、取连接的等待时间；
+    同时记录创建过的所有连接，fork 后子进程可以关闭从父进程继承来的 socket
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._stats_lock = threading.Lock()
+        self._steady_connections = weakref.WeakSet()
+        self._created = 0
+        self._reset_wait_stats()
+        super().__init__(*args, **kwargs)  # 会预先创建 mincached 个空闲连接
+        self._reset_wait_stats()  # 预建连接不算借出
+
+    def _reset_wait_stats(self):
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def steady_connection(self):
+        con = super().steady_connection()
+        with self._stats_lock:
+            self._steady_connections.add(con)
+            self._created += 1
+        return con
+
+    def connection(self, shareable=True):
+        start = time.perf_counter()
+        con = super().connection(shareable)
+        wait = time.perf_counter() - start  # 包括连接池满时阻塞等待和新建连接的时间
+        with self._stats_lock:
+            self._checkouts += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        return con
+
+    def stats(self):
+        """
+        连接池状态
+
+        :return: {'checked_out': 借出的连接数, 'idle': 空闲连接数, 'max_connections': 最大连接数（0 为不限制）,
+                  'created': 创建过的连接数, 'checkouts': 借出次数,
+                  'wait_total_ms', 'wait_avg_ms', 'wait_max_ms': 取连接的等待时间}
+        """
+        with self._lock:
+            checked_out = self._connections
+            idle = len(self._idle_cache)
+        with self._stats_lock:
+            return {
+                'checked_out': checked_out,
+                'idle': idle,
+                'max_connections': self._maxconnections,
+                'created': self._created,
+                'checkouts': self._checkouts,
+                'wait_total_ms': round(self._wait_total * 1000, 3),
+                'wait_avg_ms': round(self._wait_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+            }
+
+    def _close_inherited(self):
+        """
+        fork 后在子进程中调用：关闭从父进程继承的 socket。
+        只关闭子进程中的文件描述符，不发送 COM_QUIT，父进程的连接不受影响；
+        连接池清空后，子进程再使用这个连接池会创建自己的连接
+        """
+        for steady in list(self._steady_connections):
+            raw = getattr(steady, '_con', None)
+            if raw is not None and hasattr(raw, '_force_close'):
+                raw._force_close()
+            steady._closed = True  # 被回收时不再调用 pymysql 的 close（会在共享的 socket 上发送 COM_QUIT）
+        self._lock = threading.Condition()  # fork 时父进程其他线程可能正持有锁
+        self._stats_lock = threading.Lock()
+        self._steady_connections = weakref.WeakSet()
+        self._idle_cache = []
+        self._shared_cache = []
+        self._connections = 0
+        self._created = 0
+        self._reset_wait_stats()
+
+
+# 存储进程级别的连接池，相同参数在同一个进程中只创建一个连接池
+_pid_pool_map = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool(**conn_kwargs) -> MonitoredPooledDB:
+    """
+    获取 pymysql 连接池，享元模式，相同参数在同一个进程中返回同一个连接池。
+    创建时预先建好 mincached 个连接；fork 出的子进程会关闭继承来的连接，使用自己的连接池。
+    连接池的 stats() 返回借出/空闲连接数和取连接的等待时间。
+
+    :param conn_kwargs: PooledDB 的参数（maxconnections、mincached、maxcached、blocking、ping 等）
+                        和 pymysql.connect 的参数（host、port、user、password、database、charset 等）
+    :return: MonitoredPooledDB
+    """
+    params = dict(maxconnections=50, mincached=5, maxcached=10, maxshared=0, blocking=True, ping=1)
+    params.update(conn_kwargs)
+    key = (os.getpid(), repr(sorted(params.items())))
+    if key not in _pid_pool_map:
+        with _pool_lock:
+            if key not in _pid_pool_map:
+                _pid_pool_map[key] = MonitoredPooledDB(creator=pymysql, **params)
+    return _pid_pool_map[key]
+
+
+def _after_fork_in_child():
+    global _pool_lock
+    _pool_lock = threading.Lock()
+    for pool in _pid_pool_map.values():
+        pool._close_inherited()
+    _pid_pool_map.clear()
+
+
+if hasattr(os, 'register_at_fork'):  # windows 没有 fork
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
 if __name__ == '__main__':
     # pymysql.connections.Connection
-    pool = PooledDB(
-        creator=pymysql,  # 使用链接数据库的模块
+    pool = get_pool(
         maxconnections=50,  # 连接池允许的最大连接数，0和None表示不限制连接数
         mincached=5,  # 初始化时，链接池中至少创建的空闲的链接，0表示不创建
         maxcached=10,  # 链接池中最多闲置的链接，0和None不限制
@@ -129,6 +711,23 @@ if __name__ == '__main__':
                            args=[('bodytest', datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'teststatus')] * 10)
         print(cursor.rowcount, cursor.lastrowid)
 
+    # 流式查询大表，每批 fetchmany 1000 行，不会把整个结果集读入内存；提前 break 时连接直接断开并换成新连接
+    with CursorContext(pool, stream=True, batch_size=1000) as cursor:
+        cursor.execute("select * from sqlachemy_queues.queue_test58")
+        for rows in cursor.iter_batches(1000):
+            print(len(rows), rows[0].status)
+
+    # 紧凑行：每行是按列名生成的 tuple 子类，不再每行一个字典，同样可以 row.status 或 row['status']
+    with CursorContext(pool, compact_rows=True) as cursor:
+        cursor.execute("select * from sqlachemy_queues.queue_test58 limit 100000")
+        rows = cursor.fetchall()
+        print(len(rows), rows[0].status, rows[0]['status'], rows[0]._asdict())
+
+    # 大批量插入，按 max_allowed_packet 拼接多行 VALUES，4 个连接并行执行，返回 {'rows', 'statements', 'seconds', 'rows_per_sec'}
+    print(bulk_insert(pool, 'sqlachemy_queues.queue_test58',
+                      ({'body': f'bulk_{i}', 'publish_timestamp': datetime.datetime.now(), 'status': 'teststatus'}
+                       for i in range(100000)), workers=4))
+
 
     def test_threads():
         """测试多线程"""
@@ -144,3 +743,7 @@ if __name__ == '__main__':
         for _ in range(3000):
             thread_pool.submit(test_threads)
         thread_pool.shutdown()
+
+    for stat in CursorContext.query_stats():  # 各语句指纹的次数、耗时、行数
+        print(stat)
+    print(pool.stats())  # 借出/空闲连接数、取连接的等待时间
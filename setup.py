@@ -54,7 +54,12 @@ setup(
                       'pymysql',
                       # 'records',
                       'dbutils==3.1.0',
-                      ]
+                      ],
+    extras_require={
+        'numpy': ['numpy'],  # nb_db_dict DbTable.to_numpy
+        'arrow': ['pyarrow'],  # nb_db_dict DbTable.to_arrow
+        'asyncio': ['sqlalchemy[asyncio]'],  # nb_db_dict aconnect，另外需要 aiosqlite / asyncpg / asyncmy 等异步驱动
+    },
 )
 """
 打包上传
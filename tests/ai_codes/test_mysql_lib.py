@@ -0,0 +1,678 @@
+# coding=utf8
+"""
+测试 mysql_lib 模块
+不需要 MySQL 服务端，用假的连接池/连接/游标代替；没有安装 nb_log 时用标准 logging 代替
+"""
+import logging
+import os
+import sys
+import threading
+import time
+import types
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+for _name in ('nb_log', 'decorator_libs'):
+    try:
+        __import__(_name)
+    except ImportError:
+        _stub = types.ModuleType(_name)
+        _stub.LogManager = lambda name: types.SimpleNamespace(
+            get_logger_and_add_handlers=lambda **kwargs: logging.getLogger(name))
+        sys.modules[_name] = _stub
+
+import pymysql
+from dbutils.pooled_db import PooledDB
+
+from db_libs import mysql_lib
+
+
+class _RecordingLogger:
+    """代替 QueryTracer.logger，记录写了哪些日志"""
+
+    def __init__(self):
+        self.records = []
+
+    def log(self, level, msg, *args):
+        self.records.append((level, msg % args))
+
+
+class _FakeTracedCursor(mysql_lib.ObjectCusor):
+    """不连接服务端的 ObjectCusor：拼接好的 sql 不发送，直接返回；sql 里有 slow 时耗时 0.05 秒，有 bad 时抛异常"""
+
+    def __init__(self, tracer):
+        connection = pymysql.connections.Connection(defer_connect=True, charset='utf8mb4')
+        connection.server_status = 0  # 正常情况下握手后由服务端返回，转义字符串时要用到
+        super().__init__(connection)
+        self.tracer = tracer
+        self.sent = []
+
+    def nextset(self):
+        return None
+
+    def _query(self, q):
+        if isinstance(q, (bytes, bytearray)):  # 多行 VALUES 的 executemany 拼出来的是 bytes
+            q = q.decode('utf8')
+        if 'slow' in q:
+            time.sleep(0.05)
+        if 'bad' in q:
+            raise pymysql.err.ProgrammingError(1064, 'You have an error in your SQL syntax')
+        self.sent.append(q)
+        self.rowcount = 1
+        return 1
+
+
+def test_query_tracer():
+    """测试 QueryTracer 的语句指纹、抽样日志、慢查询日志和统计汇总"""
+    print("\n" + "=" * 50)
+    print("测试 QueryTracer")
+    print("=" * 50)
+
+    # 1. 语句指纹
+    print("\n1. 测试语句指纹...")
+    tracer = mysql_lib.QueryTracer()
+    fp = tracer.fingerprint("SELECT * FROM t WHERE id = 5 AND name='a''b' and x in (1, 2,3)")
+    print(f"   {fp}")
+    assert fp == "SELECT * FROM t WHERE id = ? AND name=? and x in (...)"
+    assert tracer.fingerprint("select  *\n from t where id = %s and x in (%s,%s)") == \
+        "select * from t where id = ? and x in (...)"
+    assert tracer.fingerprint("select * from t where name = %(name)s and v = 1.5") == \
+        "select * from t where name = ? and v = ?"
+    assert tracer.fingerprint("INSERT INTO t (a, b) VALUES (1,'x'),(2,'y'), (3, \"z\")") == \
+        tracer.fingerprint("INSERT INTO t (a, b) VALUES (7,'q')") == "INSERT INTO t (a, b) VALUES (...)"
+    assert tracer.fingerprint(b"select * from t2 where id = 1") == "select * from t2 where id = ?"
+    assert tracer.fingerprint("select * from t where s = 'it\\'s 5'") == "select * from t where s = ?"
+
+    # 2. 抽样：sample_rate=0 不写日志，sample_rate=1 每条都写 debug 日志，并且是拼接了参数的完整 sql
+    print("\n2. 测试抽样日志...")
+    tracer = mysql_lib.QueryTracer(slow_threshold=None, sample_rate=0)
+    tracer.logger = _RecordingLogger()
+    cursor = _FakeTracedCursor(tracer)
+    for i in range(20):
+        cursor.execute('select * from t where id = %s', (i,))
+    assert tracer.logger.records == []
+    tracer.sample_rate = 1
+    cursor.execute('select * from t where name = %s', ("o'k",))
+    print(f"   {tracer.logger.records}")
+    assert len(tracer.logger.records) == 1 and tracer.logger.records[0][0] == 10
+    assert tracer.logger.records[0][1].endswith("行数 1: select * from t where name = 'o\\'k'")
+    tracer.sample_rate = 0.5
+    tracer.logger = _RecordingLogger()
+    for i in range(1000):
+        cursor.execute('select * from t where id = %s', (i,))
+    print(f"   sample_rate=0.5 时写了 {len(tracer.logger.records)} 条日志")
+    assert 350 < len(tracer.logger.records) < 650
+
+    # 3. 慢查询以 warning 级别写日志，不受 sample_rate 影响
+    print("\n3. 测试慢查询日志...")
+    tracer = mysql_lib.QueryTracer(slow_threshold=0.04, sample_rate=0)
+    tracer.logger = _RecordingLogger()
+    cursor = _FakeTracedCursor(tracer)
+    cursor.execute('select slow from t where id = %s', (9,))
+    cursor.execute('select * from t where id = %s', (1,))
+    assert len(tracer.logger.records) == 1
+    assert tracer.logger.records[0][0] == 30 and 'select slow from t where id = 9' in tracer.logger.records[0][1]
+
+    # 4. 统计汇总：同一指纹合并，executemany 只记一次，出错也计入
+    print("\n4. 测试统计汇总...")
+    tracer = mysql_lib.QueryTracer(slow_threshold=None)
+    cursor = _FakeTracedCursor(tracer)
+    for i in range(5):
+        cursor.execute('select * from t where id = %s', (i,))
+    cursor.execute('select * from t where id = 100')
+    cursor.execute('select slow from t')
+    cursor.executemany('insert into t (a, b) values (%s, %s)', [(i, 'v') for i in range(10)])
+    cursor.executemany('update t set a = %s where b = %s', [(i, 'v') for i in range(3)])
+    try:
+        cursor.execute('select bad from t')
+    except pymysql.err.ProgrammingError:
+        pass
+    stats = {item['fingerprint']: item for item in tracer.stats()}
+    for item in tracer.stats():
+        print(f"   {item}")
+    assert tracer.stats()[0]['fingerprint'] == 'select slow from t', "应按总耗时从高到低排序"
+    assert stats['select * from t where id = ?']['count'] == 6
+    assert stats['select * from t where id = ?']['rows'] == 6
+    assert stats['insert into t (a, b) values (...)']['count'] == 1, "executemany 只记一次"
+    assert stats['update t set a = ? where b = ?']['count'] == 1
+    assert stats['select bad from t']['errors'] == 1 and stats['select bad from t']['rows'] == 0
+    slow = stats['select slow from t']
+    assert slow['max_ms'] >= 50 and slow['p50_ms'] == slow['p99_ms'] == slow['max_ms'] == slow['total_ms']
+
+    # 超过 max_fingerprints 后新的指纹汇总到 <other>
+    tracer = mysql_lib.QueryTracer(slow_threshold=None, max_fingerprints=2)
+    cursor = _FakeTracedCursor(tracer)
+    for table in ('t1', 't2', 't3', 't4'):
+        cursor.execute(f'select * from {table}')
+    assert {item['fingerprint']: item['count'] for item in tracer.stats()} == \
+        {'select * from t1': 1, 'select * from t2': 1, '<other>': 2}
+    tracer.reset()
+    assert tracer.stats() == []
+
+    # 5. 未设置 tracer 时使用 CursorContext.tracer，为 None 时不统计
+    print("\n5. 测试 CursorContext.tracer...")
+    old_tracer = mysql_lib.CursorContext.tracer
+    try:
+        shared = mysql_lib.CursorContext.configure_tracer(slow_threshold=None)
+        _FakeTracedCursor(None).execute('select 1')
+        assert mysql_lib.CursorContext.query_stats()[0]['count'] == 1
+        mysql_lib.CursorContext.tracer = None
+        cursor = _FakeTracedCursor(None)
+        cursor.execute('select 1')
+        assert cursor.sent == ['select 1'] and shared.stats()[0]['count'] == 1
+    finally:
+        mysql_lib.CursorContext.tracer = old_tracer
+
+    print("\n✅ QueryTracer 测试通过！")
+
+
+class _FakeStreamResult:
+    """模仿 pymysql 的无缓冲结果集 MySQLResult"""
+    has_next = False
+
+    def __init__(self, connection, total):
+        self.connection = connection
+        self.total = total
+        self.read = 0
+        self.unbuffered_active = True
+
+    def _finish_unbuffered_query(self):
+        # SSCursor.close 时调用，把剩余的行全部读完
+        self.connection._check()
+        self.read = self.total
+        self.unbuffered_active = False
+
+
+class _FakeRawConnection:
+    """模仿 pymysql.Connection：关闭后 rollback 抛 InterfaceError、ping 抛 Error，dbutils 会据此换成新连接"""
+
+    def __init__(self, created):
+        self.open = True
+        self.quit_sent = False
+        self._result = None
+        created.append(self)
+
+    def cursor(self, cursor_class=None):
+        return cursor_class(self)
+
+    def close(self):
+        if not self.open:
+            raise pymysql.err.Error('Already closed')
+        self.quit_sent = True
+        self.open = False
+
+    def _check(self):
+        if not self.open:
+            raise pymysql.err.InterfaceError(0, '')
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise pymysql.err.Error('Already closed')
+        return True
+
+    def commit(self):
+        self._check()
+
+    def rollback(self):
+        self._check()
+
+
+class _FakeSSCursor(mysql_lib.ObjectSSCusor):
+    """每次查询返回 2500 行的无缓冲结果集，close 用 SSCursor 自己的（会把没读完的行全部读完）"""
+
+    def _query(self, q):
+        self.connection._check()
+        self._result = self.connection._result = _FakeStreamResult(self.connection, 2500)
+        self.rowcount = 2 ** 64 - 1
+        return self.rowcount
+
+    def fetchmany(self, size=None):
+        result = self._result
+        count = min(size or self.arraysize, result.total - result.read)
+        rows = [mysql_lib._Row(id=result.read + i) for i in range(count)]
+        result.read += count
+        if result.read >= result.total:
+            result.unbuffered_active = False
+        return rows
+
+
+def _make_fake_stream_pool(created, **kwargs):
+    creator = types.SimpleNamespace(
+        connect=lambda **kw: _FakeRawConnection(created), threadsafety=1, OperationalError=pymysql.err.OperationalError,
+        InterfaceError=pymysql.err.InterfaceError, InternalError=pymysql.err.InternalError)
+    return PooledDB(creator, maxconnections=2, **kwargs)
+
+
+def test_stream_discard():
+    """测试 stream=True 时提前结束读取，读了一半的连接不会还给连接池"""
+    print("\n" + "=" * 50)
+    print("测试流式查询提前结束")
+    print("=" * 50)
+
+    created = []
+    pool = _make_fake_stream_pool(created)
+
+    # 1. 全部读完，连接正常还给连接池
+    print("\n1. 测试全部读完...")
+    with mysql_lib.CursorContext(pool, cursor_class=_FakeSSCursor, stream=True, batch_size=1000) as cursor:
+        cursor.execute('select * from big')
+        sizes = [len(batch) for batch in cursor.iter_batches(1000)]
+    assert sizes == [1000, 1000, 500]
+    first = created[0]
+    assert first.open and len(created) == 1
+
+    # 2. 只读第一批就 break：不读剩余的行，关闭原连接，连接池里换成新连接
+    print("\n2. 测试提前 break...")
+    ctx = mysql_lib.CursorContext(pool, cursor_class=_FakeSSCursor, stream=True)
+    with ctx as cursor:
+        cursor.execute('select * from big')
+        for _ in ctx.batches():
+            break
+        result = first._result
+    print(f"   读了 {result.read} 行，共创建 {len(created)} 个连接")
+    assert result.read == 1000, "提前结束时不应该读完剩余的行"
+    assert not first.open and first.quit_sent
+    assert len(created) == 2 and created[1].open
+    conn = pool.connection()
+    assert conn._con._con is created[1], "连接池中的应该是新连接"  # PooledDedicatedDBConnection -> SteadyDBConnection -> 原始连接
+    conn.close()
+
+    # 3. 读取中途抛异常，异常照常抛出，连接同样被换掉
+    print("\n3. 测试读取中途抛异常...")
+    try:
+        with mysql_lib.CursorContext(pool, cursor_class=_FakeSSCursor, stream=True) as cursor:
+            cursor.execute('select * from big')
+            cursor.fetchmany(10)
+            result = created[1]._result
+            raise ValueError('处理出错')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("异常应该照常抛出")
+    assert not created[1].open and result.read == 10
+    assert len(created) == 3
+
+    # 4. 连接池 reset=False 时归还不 rollback，下次取出时 ping 失败换成新连接
+    print("\n4. 测试 reset=False 的连接池...")
+    created = []
+    pool = _make_fake_stream_pool(created, reset=False)
+    ctx = mysql_lib.CursorContext(pool, cursor_class=_FakeSSCursor, stream=True)
+    with ctx as cursor:
+        cursor.execute('select * from big')
+        next(ctx.batches())
+        result = created[0]._result
+    assert not created[0].open and result.read == 1000
+    with mysql_lib.CursorContext(pool, cursor_class=_FakeSSCursor, stream=True) as cursor:
+        cursor.execute('select * from big')
+        assert sum(len(batch) for batch in cursor.iter_batches()) == 2500
+    assert len(created) == 2 and created[1].open
+
+    print("\n✅ 流式查询提前结束测试通过！")
+
+
+class _FakeSocketConnection:
+    """get_pool 用的假 pymysql 连接，记录 socket 是否被关闭、是否发送了 COM_QUIT"""
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.sock_open = True
+        self.quit_sent = False
+
+    def _force_close(self):
+        self.sock_open = False
+
+    def close(self):
+        if not self.sock_open:
+            raise pymysql.err.Error('Already closed')
+        self.quit_sent = True
+        self.sock_open = False
+
+    def ping(self, reconnect=False):
+        if not self.sock_open:
+            raise pymysql.err.Error('Already closed')
+        return True
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_get_pool():
+    """测试 get_pool 的进程内缓存、stats() 和 fork 后子进程重置连接池"""
+    print("\n" + "=" * 50)
+    print("测试 get_pool")
+    print("=" * 50)
+
+    old_connect = pymysql.connect
+    pymysql.connect = lambda *args, **kwargs: _FakeSocketConnection(**kwargs)
+    try:
+        # 1. 相同参数在同一个进程中返回同一个连接池
+        print("\n1. 测试进程内缓存...")
+        pool = mysql_lib.get_pool(host='db1', mincached=2, maxconnections=3, maxcached=3)
+        assert mysql_lib.get_pool(host='db1', mincached=2, maxconnections=3, maxcached=3) is pool
+        assert mysql_lib.get_pool(maxcached=3, maxconnections=3, mincached=2, host='db1') is pool, "参数顺序不影响"
+        assert mysql_lib.get_pool(host='db2', mincached=2, maxconnections=3, maxcached=3) is not pool
+        assert isinstance(pool, mysql_lib.MonitoredPooledDB)
+
+        # 2. stats()
+        print("\n2. 测试 stats()...")
+        stats = pool.stats()
+        print(f"   {stats}")
+        assert stats == {'checked_out': 0, 'idle': 2, 'max_connections': 3, 'created': 2, 'checkouts': 0,
+                         'wait_total_ms': 0.0, 'wait_avg_ms': 0.0, 'wait_max_ms': 0.0}, "预建的连接不算借出"
+        held = [pool.connection() for _ in range(3)]
+        stats = pool.stats()
+        assert stats['checked_out'] == 3 and stats['idle'] == 0 and stats['created'] == 3 and stats['checkouts'] == 3
+
+        def release_later():
+            time.sleep(0.1)
+            held.pop().close()
+
+        threading.Thread(target=release_later).start()
+        conn = pool.connection()  # 连接池满，阻塞到有连接归还
+        stats = pool.stats()
+        print(f"   {stats}")
+        assert stats['checkouts'] == 4 and stats['wait_max_ms'] >= 80
+        assert abs(stats['wait_avg_ms'] - stats['wait_total_ms'] / 4) < 0.01
+        conn.close()
+        for conn in held:
+            conn.close()
+        assert pool.stats()['checked_out'] == 0 and pool.stats()['idle'] == 3
+
+        # 3. fork 后子进程重置缓存、关闭继承的 socket（不发送 COM_QUIT），父进程的连接不受影响
+        if hasattr(os, 'fork') and hasattr(os, 'register_at_fork'):
+            print("\n3. 测试 fork...")
+            inherited = [steady._con for steady in pool._steady_connections]  # 和 _close_inherited 一样取原始连接
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:  # 子进程：结果写到管道里，由父进程断言
+                try:
+                    child_pool = mysql_lib.get_pool(host='db1', mincached=2, maxconnections=3, maxcached=3)
+                    report = [
+                        all(not conn.sock_open and not conn.quit_sent for conn in inherited),
+                        child_pool is not pool,
+                        child_pool.stats()['idle'] == 2 and child_pool.stats()['created'] == 2,
+                        pool.stats()['idle'] == 0 and pool.stats()['created'] == 0,
+                    ]
+                    os.write(write_fd, repr(report).encode())
+                finally:
+                    os._exit(0)
+            os.close(write_fd)
+            os.waitpid(pid, 0)
+            with os.fdopen(read_fd) as f:
+                report = f.read()
+            print(f"   子进程: {report}")
+            assert report == repr([True, True, True, True]), "子进程应关闭继承的连接并使用自己的连接池"
+            assert all(conn.sock_open and not conn.quit_sent for conn in inherited), "父进程的连接不应受影响"
+            assert mysql_lib.get_pool(host='db1', mincached=2, maxconnections=3, maxcached=3) is pool
+    finally:
+        pymysql.connect = old_connect
+        mysql_lib._pid_pool_map.clear()
+
+    print("\n✅ get_pool 测试通过！")
+
+
+class _FakeQueryResult:
+    """模仿 pymysql 的 MySQLResult：列描述 fields，缓冲模式的 rows，无缓冲模式逐行读取"""
+    insert_id = 0
+    warning_count = 0
+    has_next = False
+
+    def __init__(self, fields, rows, unbuffered):
+        self.fields = [types.SimpleNamespace(name=name, table_name=table) for table, name in fields]
+        self.description = tuple((field.name, 253, None, None, None, None, True) for field in self.fields)
+        self.unbuffered_active = unbuffered
+        self._pending = iter(rows)
+        self.rows = None if unbuffered else tuple(rows)
+        self.affected_rows = 2 ** 64 - 1 if unbuffered else len(rows)
+
+    def _read_rowdata_packet_unbuffered(self):
+        row = next(self._pending, None)
+        if row is None:
+            self.unbuffered_active = False
+        return row
+
+    def _finish_unbuffered_query(self):
+        self.unbuffered_active = False
+
+
+class _FakeQueryConnection:
+    """不连接服务端的 pymysql 连接，query 返回预先设置好的列和行"""
+
+    def __init__(self, fields, rows):
+        self.fields = fields
+        self.rows = rows
+        self._result = None
+
+    def query(self, sql, unbuffered=False):
+        self._result = _FakeQueryResult(self.fields, self.rows, unbuffered)
+
+
+def test_slots_cursor():
+    """测试 ObjectSlotsCusor / ObjectSSSlotsCusor 返回的紧凑行"""
+    print("\n" + "=" * 50)
+    print("测试紧凑行游标")
+    print("=" * 50)
+
+    fields = [('a', 'id'), ('a', 'name'), ('a', 'price'), ('b', 'id')]
+    rows = [(i, f'name{i}', i * 1.5, i + 100) for i in range(2500)]
+
+    # 1. 缓冲游标：属性、下标、列名访问，重复列名为 '表名.列名'
+    print("\n1. 测试 ObjectSlotsCusor...")
+    cursor = mysql_lib.ObjectSlotsCusor(_FakeQueryConnection(fields, rows))
+    cursor.execute('select * from a join b on a.id = b.a_id')
+    row = cursor.fetchone()
+    print(f"   {row!r}")
+    assert row.id == row['id'] == row[0] == 0
+    assert row.name == row['name'] == row[1] == 'name0'
+    assert row['b.id'] == row[3] == 100 and row.get('b.id') == 100
+    assert row.keys() == ('id', 'name', 'price', 'b.id')
+    assert row._asdict() == {'id': 0, 'name': 'name0', 'price': 0.0, 'b.id': 100}
+    assert isinstance(row, tuple) and not hasattr(row, '__dict__'), "行应该是不带 __dict__ 的 tuple 子类"
+    try:
+        row['missing']
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("不存在的列名应抛 KeyError")
+    rest = cursor.fetchall()
+    assert len(rest) == 2499 and rest[-1].price == 2499 * 1.5
+    assert all(type(r) is type(row) for r in rest), "同一个结果集共用一个行类"
+
+    # 同一组列名只生成一次行类
+    cursor2 = mysql_lib.ObjectSlotsCusor(_FakeQueryConnection(fields, rows[:3]))
+    cursor2.execute('select * from a join b on a.id = b.a_id')
+    assert type(cursor2.fetchone()) is type(row)
+
+    # 不同的列名生成不同的行类
+    cursor3 = mysql_lib.ObjectSlotsCusor(_FakeQueryConnection([('c', 'x')], [(1,), (2,)]))
+    cursor3.execute('select x from c')
+    assert [r.x for r in cursor3.fetchall()] == [1, 2]
+
+    # 和 tuple 方法同名的列（SELECT COUNT(*) AS count）按属性取到的是列的值；SlotsRow 自己的方法不被覆盖
+    cursor4 = mysql_lib.ObjectSlotsCusor(_FakeQueryConnection([('', 'count'), ('c', 'index'), ('c', 'keys')],
+                                                              [(42, 7, 'k')]))
+    cursor4.execute('select count(*) as count, `index`, `keys` from c')
+    row = cursor4.fetchone()
+    assert row.count == 42 and row.index == 7 and row['keys'] == 'k'
+    assert row.keys() == ('count', 'index', 'keys')
+
+    # 2. 无缓冲游标：逐行读取和 iter_batches
+    print("\n2. 测试 ObjectSSSlotsCusor...")
+    cursor = mysql_lib.ObjectSSSlotsCusor(_FakeQueryConnection(fields, rows))
+    cursor.execute('select * from a join b on a.id = b.a_id')
+    row = cursor.fetchone()
+    assert row.name == 'name0' and row['b.id'] == 100 and row[2] == 0.0
+    batches = list(cursor.iter_batches(1000))
+    assert [len(batch) for batch in batches] == [1000, 1000, 499]
+    assert batches[-1][-1].id == 2499 and batches[-1][-1]['b.id'] == 2599
+    assert cursor.fetchone() is None
+    cursor.close()
+
+    print("\n✅ 紧凑行游标测试通过！")
+
+
+class _FakeBulkCursor:
+    """bulk_insert 用的假游标，记录执行过的语句"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.connection = conn.raw  # bulk_insert 用它的 escape/encoding 转义
+        self._row = None
+
+    def execute(self, query, args=None):
+        if query == 'SELECT @@max_allowed_packet':
+            packet = self._conn.pool.max_allowed_packet
+            self._row = {'@@max_allowed_packet': packet} if self._conn.pool.dict_rows else (packet,)
+            return 1
+        if b'FAIL' in query:
+            raise RuntimeError('插入失败')
+        with self._conn.pool.lock:
+            self._conn.pool.executed.append(query)
+        return 1
+
+    def fetchone(self):
+        return self._row
+
+    def mogrify(self, query, args=None):
+        return query
+
+    def close(self):
+        pass
+
+
+class _FakeBulkConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.raw = pymysql.connections.Connection(defer_connect=True, charset='utf8mb4')
+        self.raw.server_status = pool.server_status  # 正常情况下握手后由服务端返回
+
+    def cursor(self, *args):
+        return _FakeBulkCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _FakeBulkPool:
+    """假的连接池，只在前 good_connections 次 connection() 调用时返回连接，之后抛异常"""
+
+    def __init__(self, max_allowed_packet=64 * 1024, dict_rows=False, good_connections=None, server_status=0):
+        self.max_allowed_packet = max_allowed_packet
+        self.server_status = server_status
+        self.dict_rows = dict_rows
+        self.good_connections = good_connections
+        self.executed = []
+        self.lock = threading.Lock()
+
+    def connection(self):
+        if self.good_connections is not None:
+            if self.good_connections <= 0:
+                raise pymysql.err.OperationalError(2003, "Can't connect to MySQL server")
+            self.good_connections -= 1
+        return _FakeBulkConnection(self)
+
+
+def test_bulk_insert():
+    """测试 bulk_insert 的语句切分、返回的行数和工作线程的错误传递"""
+    print("\n" + "=" * 50)
+    print("测试 bulk_insert")
+    print("=" * 50)
+
+    # 1. 按 max_allowed_packet 切分语句
+    print("\n1. 测试按 max_allowed_packet 切分语句...")
+    pool = _FakeBulkPool(max_allowed_packet=4096)
+    rows = ({'id': i, 'name': f"名字'{i}", 'price': i * 1.5, 'memo': None} for i in range(2000))
+    report = mysql_lib.bulk_insert(pool, 'db.goods', rows)
+    print(f"   {report}")
+    assert report['rows'] == 2000
+    assert report['statements'] == len(pool.executed) > 1
+    assert all(len(sql) <= 4096 - 1024 for sql in pool.executed), "每条语句都不能超过 max_allowed_packet"
+    assert pool.executed[0].startswith(b'INSERT INTO `db`.`goods` (`id`, `name`, `price`, `memo`) VALUES (0,')
+    assert sum(sql.count(b"'\xe5\x90\x8d\xe5\xad\x97\\'") for sql in pool.executed) == 2000, "每一行都应该被插入且正确转义"
+
+    # max_statement_bytes 比 max_allowed_packet 小时以它为准
+    pool = _FakeBulkPool()
+    report = mysql_lib.bulk_insert(pool, 't', [(i, 'x' * 100) for i in range(500)], max_statement_bytes=8192)
+    assert report['rows'] == 500
+    assert all(len(sql) <= 8192 - 1024 for sql in pool.executed)
+
+    # 服务端开启 NO_BACKSLASH_ESCAPES 时单引号要写成两个单引号，反斜杠不再是转义符
+    pool = _FakeBulkPool()
+    mysql_lib.bulk_insert(pool, 't', [("it's", b"a'b", 1, None)])
+    assert pool.executed == [b"INSERT INTO `t` VALUES ('it\\'s',X'612762',1,NULL)"]
+    pool = _FakeBulkPool(server_status=pymysql.constants.SERVER_STATUS.SERVER_STATUS_NO_BACKSLASH_ESCAPES)
+    mysql_lib.bulk_insert(pool, 't', [("it's", b"a'b", 1, None), ('x\\', b'y\\', 2.5, 'z')])
+    print(f"   NO_BACKSLASH_ESCAPES: {pool.executed[0]}")
+    assert pool.executed == [b"INSERT INTO `t` VALUES ('it''s',X'612762',1,NULL),('x\\',X'795c',2.5e0,'z')"]
+
+    # 2. 连接池的 cursorclass 是 DictCursor
+    print("\n2. 测试 DictCursor 连接池...")
+    pool = _FakeBulkPool(max_allowed_packet=4096, dict_rows=True)
+    report = mysql_lib.bulk_insert(pool, 't', [(i, 'x') for i in range(1000)], columns=['id', 'name'])
+    assert report['rows'] == 1000 and report['statements'] > 1
+
+    # 3. 多线程执行
+    print("\n3. 测试多线程执行...")
+    pool = _FakeBulkPool(max_allowed_packet=4096)
+    report = mysql_lib.bulk_insert(pool, 't', [(i, 'x' * 20) for i in range(3000)], workers=4)
+    print(f"   {report}")
+    assert report['rows'] == 3000 and report['statements'] == len(pool.executed)
+
+    # 空数据
+    assert mysql_lib.bulk_insert(_FakeBulkPool(), 't', [])['rows'] == 0
+
+    # 4. 工作线程执行语句出错，异常传回调用方
+    print("\n4. 测试工作线程出错...")
+    pool = _FakeBulkPool(max_allowed_packet=4096)
+    rows = [(i, 'FAIL' if i == 1500 else 'x') for i in range(3000)]
+    try:
+        mysql_lib.bulk_insert(pool, 't', rows, workers=3)
+    except RuntimeError as e:
+        print(f"   收到异常: {e}")
+    else:
+        raise AssertionError("工作线程的异常应该传给调用方")
+
+    # 5. 工作线程取不到连接，不能卡住，异常传回调用方
+    print("\n5. 测试工作线程取不到连接...")
+    result = {}
+
+    def run():
+        try:
+            mysql_lib.bulk_insert(_FakeBulkPool(max_allowed_packet=4096, good_connections=1), 't',
+                                  [(i, 'x' * 20) for i in range(3000)], workers=3)
+        except pymysql.err.OperationalError as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), "工作线程取不到连接时 bulk_insert 不应卡住"
+    assert 'error' in result, "取连接的异常应该传给调用方"
+
+    print("\n✅ bulk_insert 测试通过！")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("mysql_lib 模块测试")
+    print("=" * 60)
+
+    test_query_tracer()
+    test_bulk_insert()
+    test_stream_discard()
+    test_get_pool()
+    test_slots_cursor()
+
+    print("\n" + "=" * 60)
+    print("🎉 所有测试通过！")
+    print("=" * 60)
@@ -7,6 +7,7 @@ import os
 import sys
 import tempfile
 from datetime import datetime
+from decimal import Decimal
 
 # 添加项目路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -337,6 +338,1319 @@ def test_table_operations():
                 pass
 
 
+def test_buffered_writer():
+    """测试缓冲写入器（多线程写入，后台批量刷新）"""
+    print("\n" + "=" * 50)
+    print("测试缓冲写入器")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        logs = db['task_logs']
+        
+        import threading
+        writer = logs.buffered(max_rows=50, max_delay=0.2)
+        assert logs.buffered(max_rows=50, max_delay=0.2) is writer, "相同参数应返回同一个写入器"
+        
+        def worker(n):
+            for i in range(100):
+                row = {'worker': n, 'seq': i}
+                if i % 10 == 0:
+                    row['extra'] = f'extra_{i}'  # 不同行的列不完全相同
+                writer.insert(row)
+        
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        writer.flush()
+        print(f"   刷新后记录数: {logs.count()}, 列: {logs.columns}")
+        assert logs.count() == 400
+        assert 'extra' in logs.columns
+        
+        # 超过 max_delay 自动刷新
+        writer.insert({'worker': 99, 'seq': 0})
+        import time
+        time.sleep(0.6)
+        assert logs.count(worker=99) == 1, "超过 max_delay 后应自动刷新"
+        
+        # 错误回调
+        errors = []
+        bad_writer = logs.buffered(max_rows=10, max_delay=5, on_error=lambda e, rows: errors.append(len(rows)))
+        bad_writer.insert({'worker': object()})  # 无法写入的值
+        bad_writer.close()
+        print(f"   错误回调收到: {errors}")
+        assert errors == [1]
+        assert bad_writer.closed
+        
+        # 相同 max_rows/max_delay 但 on_error 不同，应拿到各自的写入器，回调不能丢
+        plain_writer = logs.buffered(max_rows=10, max_delay=5)
+        other_errors = []
+        other_writer = logs.buffered(max_rows=10, max_delay=5, on_error=lambda e, rows: other_errors.append(len(rows)))
+        assert other_writer is not plain_writer, "on_error 不同不应复用同一个写入器"
+        other_writer.insert({'worker': object()})
+        other_writer.close()
+        plain_writer.close()
+        assert other_errors == [1], "on_error 回调应被调用"
+        
+        writer.close()
+        print("\n✅ 缓冲写入器测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_native_upsert():
+    """测试原生 upsert 和 upsert_many"""
+    print("\n" + "=" * 50)
+    print("测试原生 upsert 和 upsert_many")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        stocks = db['stocks']
+        stocks.insert({'code': '000001', 'price': 10.0})
+        
+        # 没有唯一约束时退化为 SELECT + UPDATE/INSERT
+        assert not stocks._supports_native_upsert(['code'])
+        stocks.upsert_many([{'code': '000001', 'price': 11.0}, {'code': '000002', 'price': 20.0}], keys=['code'])
+        assert stocks.count() == 2
+        assert stocks.find_one(code='000001')['price'] == 11.0
+        
+        # 建唯一索引后走原生 ON CONFLICT DO UPDATE
+        db.execute('CREATE UNIQUE INDEX ux_stocks_code ON stocks (code)')
+        db.invalidate_metadata('stocks')
+        assert stocks._supports_native_upsert(['code'])
+        stocks.upsert({'code': '000002', 'price': 21.0}, keys=['code'])
+        assert stocks.find_one(code='000002')['price'] == 21.0
+        
+        rows = [{'code': f'{i:06d}', 'price': float(i)} for i in range(5000)]
+        rows.append({'code': '000001', 'price': 99.0, 'name': '平安银行'})  # 同一批中重复的 key，新增的列
+        count = stocks.upsert_many(rows, keys=['code'], chunk_size=2000)
+        print(f"   upsert_many 处理 {count} 条, 表中 {stocks.count()} 条")
+        assert stocks.count() == 5000
+        assert stocks.find_one(code='000001')['name'] == '平安银行'
+        assert stocks.find_one(code='000001')['price'] == 99.0
+        assert stocks.find_one(code='000002')['price'] == 2.0
+        
+        # key 为 None 时 NULL 不触发唯一约束冲突，要按 IS NULL 更新已有的行，不能重复插入
+        stocks.upsert({'code': None, 'price': 1.0}, keys=['code'])
+        stocks.upsert({'code': None, 'price': 2.0}, keys=['code'])
+        stocks.upsert_many([{'code': None, 'price': 3.0}, {'code': '000003', 'price': 3.0}], keys=['code'])
+        assert stocks.count(code=None) == 1
+        assert stocks.find_one(code=None)['price'] == 3.0
+        assert stocks.count() == 5001
+        
+        print("\n✅ 原生 upsert 测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_find_iter():
+    """测试流式查询 find_iter 和流式迭代"""
+    print("\n" + "=" * 50)
+    print("测试流式查询")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        events = db['events']
+        events.insert_many([{'seq': i, 'kind': 'odd' if i % 2 else 'even'} for i in range(2500)])
+        
+        it = events.find_iter(_batch_size=100, _order_by='-seq', kind='odd')
+        first = next(it)
+        print(f"   第一条: {first}")
+        assert first['seq'] == 2499
+        rest = list(it)
+        assert len(rest) == 1249
+        
+        assert sum(1 for _ in events) == 2500
+        assert [r['seq'] for r in events.find_iter(_limit=3, _offset=10, _order_by='seq')] == [10, 11, 12]
+        assert list(db['not_exists'].find_iter()) == []
+        
+        print("\n✅ 流式查询测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_scan():
+    """测试键集分页扫描 scan 和断点续扫"""
+    print("\n" + "=" * 50)
+    print("测试键集分页扫描")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        orders = db['scan_orders']
+        orders.insert_many([{'shop': i % 7, 'amount': i % 3} for i in range(1000)])
+        
+        batches = list(orders.scan(_batch_size=300))
+        print(f"   每批行数: {[len(b) for b in batches]}")
+        assert [len(b) for b in batches] == [300, 300, 300, 100]
+        assert batches[0].resume_token == 300
+        
+        # 从第二批之后断点续扫
+        resumed = [row['id'] for batch in orders.scan(_batch_size=300, _resume_token=batches[1].resume_token) for row in batch]
+        assert resumed == list(range(601, 1001))
+        
+        # 按有重复值的列降序扫描，会自动追加主键，不漏行不重复
+        ids = [row['id'] for batch in orders.scan(_batch_size=64, _order_by='-amount', shop=3) for row in batch]
+        assert sorted(ids) == [r['id'] for r in orders.find(shop=3, _order_by='id')]
+        assert len(ids) == len(set(ids))
+        
+        # 排序列有 NULL 值时也不漏行不重复，NULL 排在最前（降序时最后）
+        people = db['scan_people']
+        people.insert_many([{'name': None, 'age': None} for _ in range(25)] +
+                           [{'name': f'n{i % 20:02d}', 'age': None if i % 4 == 0 else i % 9} for i in range(50)])
+        for order_by in ('name', '-name', ['name', 'age'], ['-name', '-age']):
+            scanned = [row for batch in people.scan(_batch_size=10, _order_by=order_by) for row in batch]
+            ids = [row['id'] for row in scanned]
+            assert len(ids) == 75 and len(set(ids)) == 75, f"按 {order_by} 扫描漏行或重复: {len(set(ids))}"
+            names = [row['name'] for row in scanned]
+            nulls_first = not str(order_by).startswith(("-", "['-"))
+            assert names[:25] == [None] * 25 if nulls_first else names[-25:] == [None] * 25
+        
+        # 从 NULL 排序键的断点续扫
+        batches = list(people.scan(_batch_size=10, _order_by='name'))
+        assert batches[1].resume_token == [None, 20]  # 自动追加了主键
+        resumed = [row['id'] for batch in people.scan(_batch_size=10, _order_by='name',
+                                                      _resume_token=batches[1].resume_token) for row in batch]
+        assert resumed == [row['id'] for batch in batches[2:] for row in batch]
+        
+        print("\n✅ 键集分页扫描测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_batched_schema_evolution():
+    """测试一次添加多列，添加后不重新反射表结构"""
+    print("\n" + "=" * 50)
+    print("测试批量添加列")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        from sqlalchemy import event
+        db = connect(f'sqlite:///{db_path}')
+        wide = db['wide_rows']
+        wide.insert({'name': 'first'})
+        
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        
+        row = {f'field_{i}': i for i in range(20)}
+        row.update({'name': 'second', 'payload': {'a': 1}, 'created_at': datetime(2024, 1, 2, 3, 4, 5)})
+        wide.insert(row)
+        
+        alters = [sql for sql in statements if sql.startswith('ALTER TABLE')]
+        reflections = [sql for sql in statements if 'PRAGMA' in sql.upper()]
+        print(f"   ALTER 语句数: {len(alters)}, 反射语句数: {len(reflections)}")
+        assert len(alters) == 22  # SQLite 不支持一条 ALTER 加多列，逐列执行
+        assert not reflections, "添加列后不应重新反射表结构"
+        
+        result = wide.find_one(name='second')
+        assert result['field_19'] == 19
+        assert result['payload'] == {'a': 1}
+        assert result['created_at'] == datetime(2024, 1, 2, 3, 4, 5)
+        
+        # 重新反射出来的表结构和内存中的一致
+        from db_libs.nb_db_dict import Database
+        other = Database(f'sqlite:///{db_path}')
+        assert sorted(other['wide_rows'].columns) == sorted(wide.columns)
+        other.close()
+        
+        print("\n✅ 批量添加列测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_insert_many_chunked():
+    """测试生成器分块批量插入"""
+    print("\n" + "=" * 50)
+    print("测试生成器分块批量插入")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        metrics = db['chunked_metrics']
+        
+        def gen_rows(n):
+            for i in range(n):
+                row = {'seq': i, 'value': i * 0.5}
+                if i >= 2500:
+                    row['late_key'] = f'late_{i}'  # 第 3 块才出现的新键
+                yield row
+        
+        progress = []
+        count = metrics.insert_many(gen_rows(10000), chunk_size=1000, on_progress=progress.append)
+        print(f"   插入 {count} 条, 进度回调: {progress[:3]}...{progress[-1]}")
+        assert count == 10000
+        assert progress == list(range(1000, 10001, 1000))
+        assert metrics.count() == 10000
+        assert metrics.find_one(seq=9999)['late_key'] == 'late_9999'
+        
+        # 单个事务，后面的块出现新键时在同一个连接上 ALTER
+        count = metrics.insert_many(({'seq': i, 'tx_key': i} if i > 150 else {'seq': i} for i in range(300)),
+                                    chunk_size=100, single_transaction=True)
+        assert count == 300
+        assert metrics.count() == 10300
+        assert metrics.find_one(seq=299, tx_key=299) is not None
+        
+        assert metrics.insert_many(iter([])) == 0
+        assert db['never_created'].insert_many([]) == 0
+        assert 'never_created' not in db
+        
+        print("\n✅ 生成器分块批量插入测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_statement_cache():
+    """测试语句缓存和命中统计"""
+    print("\n" + "=" * 50)
+    print("测试语句缓存")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        kv = db['kv']
+        for i in range(100):
+            kv.insert({'k': f'key_{i}', 'v': i})
+        for i in range(100):
+            assert kv.find_one(k=f'key_{i}')['v'] == i
+            kv.update({'k': f'key_{i}', 'v': i + 1}, keys=['k'])
+        assert kv.count(v=None) == 0
+        
+        stats = kv.statement_cache_stats()
+        print(f"   缓存统计: {stats}")
+        assert stats['hits'] >= 290
+        assert stats['size'] <= 5
+        
+        # 新增列后缓存失效，查询结果包含新列
+        kv.insert({'k': 'key_new', 'v': 0, 'extra': 'x'})
+        assert kv.find_one(k='key_new')['extra'] == 'x'
+        assert kv.find_one(k='key_1')['extra'] is None
+        assert kv.find(_limit=2, _offset=3, _order_by='-v')[0]['v'] == 97
+        
+        # 构建语句期间其他线程改了表结构：按旧表结构构建的语句不能被之后的调用取到
+        def build_while_schema_changes():
+            stmt = object()
+            kv._clear_stmt_cache()  # 模拟另一个线程加列后清空缓存
+            return stmt
+        
+        stale = kv._get_stmt(('race',), build_while_schema_changes)
+        assert kv._get_stmt(('race',), object) is not stale, "表结构变化前构建的语句不应被缓存复用"
+        assert kv._get_stmt(('race',), object) is kv._get_stmt(('race',), object)
+        
+        print("\n✅ 语句缓存测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_transaction_scope():
+    """测试事务作用域：多个操作、多张表复用一个连接，异常时回滚"""
+    print("\n" + "=" * 50)
+    print("测试事务作用域")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        from sqlalchemy import event
+        db = connect(f'sqlite:///{db_path}')
+        accounts = db['accounts']
+        accounts.insert({'name': 'a', 'balance': 100})
+        
+        checkouts = []
+        event.listen(db.engine.pool, 'checkout', lambda *args: checkouts.append(1))
+        with db.transaction():
+            for i in range(100):
+                accounts.insert({'name': f'user_{i}', 'balance': i})
+            db['ledger'].insert({'account': 'a', 'delta': -10})
+            accounts.update({'name': 'a', 'balance': 90}, keys=['name'])
+            assert accounts.count() == 101  # 事务内可以读到未提交的数据
+        print(f"   事务内 100+ 次操作的连接检出次数: {len(checkouts)}")
+        assert len(checkouts) == 1
+        assert accounts.find_one(name='a')['balance'] == 90
+        assert db['ledger'].count() == 1
+        
+        # 异常回滚；事务中新增的列和新建的表会重新加载，和数据库实际的表结构保持一致
+        # （pysqlite 默认模式下 DDL 不在事务内，PostgreSQL 会随事务回滚）
+        from sqlalchemy import inspect
+        try:
+            with accounts.session():
+                accounts.insert({'name': 'b', 'balance': 1, 'new_col': 'x'})
+                db['tx_only_table'].insert({'x': 1})
+                raise RuntimeError('故意抛出异常')
+        except RuntimeError:
+            pass
+        assert accounts.count(name='b') == 0
+        assert accounts.columns == [c['name'] for c in inspect(db.engine).get_columns('accounts')]
+        assert db['tx_only_table'].count() == 0
+        accounts.insert({'name': 'c', 'balance': 2})
+        assert accounts.find_one(name='c')['balance'] == 2
+        
+        # 嵌套事务复用外层事务
+        with db.transaction() as outer:
+            with accounts.session() as inner:
+                assert inner is outer
+                accounts.insert({'name': 'd'})
+        assert accounts.count(name='d') == 1
+        
+        print("\n✅ 事务作用域测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_metadata_cache():
+    """测试表名缓存：TTL、本地更新和显式失效"""
+    print("\n" + "=" * 50)
+    print("测试元数据缓存")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        from sqlalchemy import event
+        db = connect(f'sqlite:///{db_path}', metadata_ttl=None)
+        db['cached_a'].insert({'x': 1})
+        
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        for _ in range(100):
+            assert 'cached_a' in db
+            assert 'cached_missing' not in db
+        db['cached_b']
+        listing = [sql for sql in statements if 'sqlite_master' in sql]
+        print(f"   查询表名的语句数: {len(listing)}")
+        assert not listing
+        
+        # 本进程建表/删表直接更新缓存
+        db.create_table('cached_c')
+        assert 'cached_c' in db
+        db.drop_table('cached_c')
+        assert 'cached_c' not in db
+        
+        # 其他连接建表/加列，显式失效后可见
+        other = Database(f'sqlite:///{db_path}')
+        other['cached_a'].insert({'x': 2, 'y': 'new'})
+        other['cached_d'].insert({'z': 1})
+        other.close()
+        assert 'cached_d' not in db
+        db.invalidate_metadata()
+        assert 'cached_d' in db
+        assert 'y' in db['cached_a'].columns
+        assert db['cached_d'].find_one()['z'] == 1
+        
+        # TTL 过期后重新查询
+        db._metadata_ttl = 0
+        import time
+        time.sleep(0.01)
+        assert db.tables == ['cached_a', 'cached_d']
+        
+        print("\n✅ 元数据缓存测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_columnar_fetch():
+    """测试列式查询 find_columns / to_numpy / to_arrow"""
+    print("\n" + "=" * 50)
+    print("测试列式查询")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        ticks = db['ticks']
+        ticks.insert_many([{'code': f'c{i % 3}', 'price': i * 1.5, 'volume': i,
+                            'ts': datetime(2024, 1, 1, 0, 0, i % 60), 'ok': i % 2 == 0,
+                            'amount': Decimal(i) / 4}
+                           for i in range(1000)])
+        ticks.insert({'code': 'c9', 'price': None, 'volume': None, 'ts': None, 'ok': None, 'amount': None})
+        
+        data = ticks.find_columns(_columns=['code', 'volume'], _order_by='-volume', _limit=3, _batch_size=2)
+        print(f"   find_columns: {data}")
+        assert data == {'code': ['c0', 'c2', 'c1'], 'volume': [999, 998, 997]}
+        
+        try:
+            import numpy as np
+        except ImportError:
+            print("   未安装 numpy，跳过 to_numpy")
+        else:
+            arrays = ticks.to_numpy(code='c0', _batch_size=100)
+            assert arrays['volume'].dtype == np.int64
+            assert arrays['ts'].dtype == np.dtype('datetime64[us]')
+            assert arrays['ok'].dtype == np.bool_
+            assert len(arrays['price']) == 334
+            assert arrays['price'].sum() == sum(i * 1.5 for i in range(0, 1000, 3))
+            
+            all_arrays = ticks.to_numpy(_columns=['volume', 'ts'], _batch_size=300)
+            assert all_arrays['volume'].dtype == np.float64  # 有 NULL 的整数列
+            assert np.isnan(all_arrays['volume'][-1])
+            assert np.isnat(all_arrays['ts'][-1])
+            
+            # 有 NULL 的布尔列不能把 NULL 变成 False
+            ok = ticks.to_numpy(_columns=['ok'], _batch_size=300)['ok']
+            assert ok.dtype == object and ok[-1] is None and ok[0] is True and ok[1] is False
+            assert ticks.to_numpy(_columns=['amount'], code='c0')['amount'][1] == 0.75
+        
+        try:
+            import pyarrow as pa
+        except ImportError:
+            print("   未安装 pyarrow，跳过 to_arrow")
+        else:
+            arrow_table = ticks.to_arrow(_batch_size=256)
+            print(f"   to_arrow schema: {arrow_table.schema}")
+            assert arrow_table.num_rows == 1001
+            assert arrow_table.schema.field('volume').type == pa.int64()
+            assert arrow_table.column('volume').null_count == 1
+            assert arrow_table.column('code').to_pylist()[-1] == 'c9'
+            assert arrow_table.schema.field('amount').type == pa.decimal128(20, 6)
+            assert arrow_table.column('amount').to_pylist()[3] == Decimal('0.75')
+            assert arrow_table.column('amount').null_count == 1
+            assert arrow_table.column('ok').null_count == 1
+        
+        print("\n✅ 列式查询测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_insert_columns():
+    """测试列式批量插入 insert_columns / insert_frame"""
+    print("\n" + "=" * 50)
+    print("测试列式批量插入")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        
+        # 普通列表组成的列
+        plain = db['plain']
+        count = plain.insert_columns({'name': ['a', 'b', None], 'meta': [{'x': 1}, None, [1, 2]]}, chunk_size=2)
+        assert count == 3
+        rows = plain.all()
+        assert [r['name'] for r in rows] == ['a', 'b', None]
+        assert [r['meta'] for r in rows] == [{'x': 1}, None, [1, 2]]
+        
+        try:
+            import numpy as np
+        except ImportError:
+            print("   未安装 numpy，跳过 numpy/pandas/pyarrow 部分")
+            return
+        
+        arrays = db['arrays']
+        arrays.insert_columns({
+            'volume': np.arange(5, dtype=np.int64),
+            'price': np.array([1.5, np.nan, 2.5, 3.5, 4.5]),
+            'ok': np.array([True, False, True, False, True]),
+            'ts': np.array(['2024-01-01T00:00:00', 'NaT', '2024-01-02T12:00:00', '2024-01-03', '2024-01-04'],
+                           dtype='datetime64[ns]'),
+        }, chunk_size=2)
+        from sqlalchemy import inspect
+        column_types = {c['name']: type(c['type']).__name__ for c in inspect(db.engine).get_columns('arrays')}
+        print(f"   推断的列类型: {column_types}")
+        assert column_types['volume'] == 'BIGINT' and column_types['price'] == 'FLOAT'
+        assert column_types['ok'] == 'BOOLEAN' and column_types['ts'] == 'DATETIME'
+        rows = arrays.find(_order_by='volume')
+        assert [r['volume'] for r in rows] == [0, 1, 2, 3, 4]
+        assert rows[1]['price'] is None and rows[1]['ts'] is None
+        assert rows[2]['ok'] is True and rows[2]['ts'] == datetime(2024, 1, 2, 12)
+        
+        try:
+            import pandas as pd
+        except ImportError:
+            print("   未安装 pandas，跳过 insert_frame")
+        else:
+            df = pd.DataFrame({
+                'code': ['x' * 300, 'b', None],
+                'qty': pd.array([1, None, 3], dtype='Int64'),
+                'amount': [1.0, None, 3.0],
+            }, index=[10, 20, 30])
+            frames = db['frames']
+            assert frames.insert_frame(df) == 3
+            rows = frames.all()
+            assert rows[0]['code'] == 'x' * 300
+            assert [r['qty'] for r in rows] == [1, None, 3]
+            assert [r['amount'] for r in rows] == [1.0, None, 3.0]
+            assert 'index' not in frames.columns
+        
+        try:
+            import pyarrow as pa
+        except ImportError:
+            print("   未安装 pyarrow，跳过 pyarrow.Table")
+        else:
+            arrow_table = pa.table({'k': pa.array([1, None, 3], type=pa.int32()), 's': ['a', 'b', None]})
+            arrow_rows = db['arrow_rows']
+            assert arrow_rows.insert_columns(arrow_table) == 3
+            assert [(r['k'], r['s']) for r in arrow_rows.all()] == [(1, 'a'), (None, 'b'), (3, None)]
+        
+        print("\n✅ 列式批量插入测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_bulk_load():
+    """测试原生批量导入 bulk_load"""
+    print("\n" + "=" * 50)
+    print("测试原生批量导入")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        events = db['events']
+        
+        progress = []
+        rows = ({'seq': i, 'name': f'e{i}', 'meta': {'i': i}} if i % 2 else {'seq': i, 'extra': 'x'}
+                for i in range(2500))
+        count = events.bulk_load(rows, chunk_size=1000, on_progress=progress.append)
+        print(f"   导入 {count} 条，进度: {progress}")
+        assert count == 2500 and progress == [1000, 2000, 2500]
+        assert events.count() == 2500
+        assert events.find_one(seq=1)['meta'] == {'i': 1}
+        assert events.find_one(seq=2)['extra'] == 'x'
+        assert set(events.columns) == {'id', 'seq', 'name', 'meta', 'extra'}
+        
+        # 导入结束后恢复连接的 PRAGMA 设置
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() != 'memory'
+        
+        # 导入出错时整体回滚
+        try:
+            events.bulk_load(iter([{'seq': 1}, {'id': 1, 'seq': 2}]), chunk_size=1)
+        except Exception:
+            pass
+        else:
+            raise AssertionError('主键冲突应该抛出异常')
+        assert events.count() == 2500
+        
+        assert events.bulk_load([{'seq': -1}], method='insert_many') == 1
+        try:
+            events.bulk_load([{'seq': -2}], method='bcp')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('不支持的 method 应该抛出 ValueError')
+        
+        # COPY / LOAD DATA 的字段格式
+        assert [DbTable._csv_field(v) for v in (None, '', 'a"b', 3, True, b'\x01')] == \
+            ['', '""', '"a""b"', '3', 'True', '\\x01']
+        assert [DbTable._tsv_field(v) for v in (None, 'a\tb\nc\\', False, 1.5)] == \
+            ['\\N', 'a\\tb\\nc\\\\', '0', '1.5']
+        
+        print("\n✅ 原生批量导入测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_async_database():
+    """测试 asyncio 版本 aconnect / AsyncDatabase / AsyncDbTable"""
+    print("\n" + "=" * 50)
+    print("测试 asyncio 版本")
+    print("=" * 50)
+    
+    try:
+        import aiosqlite  # noqa: F401
+        import greenlet  # noqa: F401
+    except ImportError:
+        print("   未安装 aiosqlite / greenlet，跳过")
+        return
+    
+    import asyncio
+    from db_libs.nb_db_dict import aconnect
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    async def main():
+        url = f'sqlite+aiosqlite:///{db_path}'
+        db = aconnect(url)
+        assert aconnect(url) is db
+        try:
+            users = db['users']
+            assert db['users'] is users
+            
+            user_id = await users.insert({'name': '张三', 'age': 25})
+            assert user_id == 1
+            
+            # 并发写入，各自带有新列，自动加列串行执行，不会阻塞事件循环
+            await asyncio.gather(*[users.insert({'name': f'u{i}', f'col{i % 3}': i}) for i in range(9)])
+            assert {'col0', 'col1', 'col2'} <= set(users.columns)
+            assert await users.count() == 10
+            
+            async def gen():
+                for i in range(25):
+                    yield {'name': f'g{i}', 'score': i * 1.5}
+            assert await users.insert_many(gen(), chunk_size=10) == 25
+            assert await users.insert_many([{'name': 'x'}, {'name': 'y', 'age': 1}]) == 2
+            assert await users.count(name='g3') == 1
+            
+            assert await users.upsert({'name': '张三', 'age': 26}, keys=['name']) is True
+            assert (await users.find_one(name='张三'))['age'] == 26
+            assert await users.update({'name': 'x', 'age': 9}, keys=['name']) == 1
+            
+            rows = await users.find(_order_by='-id', _limit=2)
+            assert [r['name'] for r in rows] == ['y', 'x']
+            
+            names = [row['name'] async for row in users.find_iter(_batch_size=7, _order_by='id')]
+            assert len(names) == 37 and names[0] == '张三'
+            assert len([row async for row in users]) == 37
+            
+            assert await users.delete(name='y') == 1
+            assert 'users' in await db.tables()
+            assert (await db.query('SELECT COUNT(*) AS n FROM users'))[0]['n'] == 36
+            
+            # 出错时整体回滚
+            try:
+                await users.insert_many([{'id': 1000, 'name': 'a'}, {'id': 1000, 'name': 'b'}])
+            except Exception:
+                pass
+            else:
+                raise AssertionError('主键冲突应该抛出异常')
+            assert await users.count(id=1000) == 0
+            
+            assert await db['empty'].find() == []
+            assert [row async for row in db['empty']] == []
+        finally:
+            await db.close()
+    
+    try:
+        asyncio.run(main())
+        print("\n✅ asyncio 版本测试通过！")
+    finally:
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_index_management():
+    """测试索引管理 create_index / ensure_index / auto_index"""
+    print("\n" + "=" * 50)
+    print("测试索引管理")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        orders = db['orders']
+        orders.insert_many([{'code': f'c{i % 10}', 'day': i, 'memo': 'x' * 300} for i in range(100)])
+        assert orders.indexes == [{'name': None, 'columns': ('id',), 'unique': True}]
+        
+        name = orders.create_index(['code', 'day'])
+        assert name == 'ix_orders_code_day'
+        assert {'name': name, 'columns': ('code', 'day'), 'unique': False} in orders.indexes
+        
+        # 已有索引的前缀列可以直接使用，不重复建
+        assert orders.ensure_index('code') is False
+        assert orders.ensure_index(['day', 'code']) is False
+        assert orders.ensure_index('memo') is True
+        
+        # 有重复数据时不能建唯一索引
+        try:
+            orders.create_index('code', unique=True)
+        except Exception as e:
+            print(f"   重复数据建唯一索引失败: {type(e).__name__}")
+        else:
+            raise AssertionError('重复数据建唯一索引应该失败')
+        assert not any(index['unique'] and index['columns'] == ('code',) for index in orders.indexes)
+        
+        try:
+            orders.create_index('no_such_column')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('不存在的列应该抛出 ValueError')
+        
+        # 索引缓存：第二次 ensure_index 不查询数据库
+        from sqlalchemy import event
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        assert orders.ensure_index(['code', 'day']) is False
+        assert statements == []
+        
+        # 反射其他连接建的索引
+        db.execute('CREATE INDEX ix_orders_day ON orders (day)')
+        db.invalidate_metadata('orders')
+        assert any(index['name'] == 'ix_orders_day' for index in orders.indexes)
+        
+        # auto_index=True：只建普通索引，不改变 insert 的行为
+        plain = db['plain_prices']
+        plain.auto_index = True
+        plain.upsert({'code': 'a', 'price': 1.0}, keys=['code'])
+        assert {'name': 'ix_plain_prices_code', 'columns': ('code',), 'unique': False} in plain.indexes
+        plain.insert({'code': 'a', 'price': 9.0})
+        assert plain.count(code='a') == 2, "默认的自动索引不应让重复 insert 报错"
+        
+        # auto_index='unique'：第一次作为 upsert keys 时建唯一索引，之后走原生 upsert
+        prices = db['prices']
+        prices.auto_index = 'unique'
+        prices.upsert({'code': 'a', 'price': 1.0}, keys=['code'])
+        assert {'name': 'ux_prices_code', 'columns': ('code',), 'unique': True} in prices.indexes
+        assert prices._supports_native_upsert(['code'])
+        prices.upsert_many([{'code': 'a', 'price': 2.0}, {'code': 'b', 'price': 3.0}], keys=['code'])
+        assert prices.count() == 2 and prices.find_one(code='a')['price'] == 2.0
+        
+        # 已有重复数据时退化为普通索引；update 的 keys 建普通索引
+        orders.auto_index = 'unique'
+        orders.upsert({'code': 'c1', 'day': 1000}, keys=['day', 'code'])
+        orders.upsert({'code': 'c1', 'day': 1001, 'memo': 'y'}, keys=['memo'])
+        assert {'name': 'ix_orders_memo', 'columns': ('memo',), 'unique': False} in orders.indexes
+        orders.update({'day': 5, 'code': 'z'}, keys=['day'])
+        assert orders.find_one(day=5)['code'] == 'z'
+        
+        # MySQL 的 TEXT/BLOB 列只能建前缀索引：不建唯一前缀索引，auto_index='unique' 改建普通索引，
+        # 反射到的唯一前缀索引也不用来判断原生 upsert 的冲突
+        db.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, body TEXT, n INTEGER)')
+        db.invalidate_metadata()
+        notes = db['notes']
+        dialect = db.engine.dialect
+        dialect.name = 'mysql'  # 只检查建索引前的判断，建索引的语句仍由 SQLite 编译执行
+        try:
+            assert notes._prefix_lengths(['body', 'n']) == {'body': 255}
+            try:
+                notes.create_index('body', unique=True)
+            except ValueError as e:
+                print(f"   {e}")
+            else:
+                raise AssertionError("MySQL 的 TEXT 列不应建唯一前缀索引")
+            notes._auto_index_keys(['body'], unique=True)
+            assert {'name': 'ix_notes_body', 'columns': ('body',), 'unique': False} in notes.indexes
+        finally:
+            del dialect.name
+        db.execute('CREATE UNIQUE INDEX ux_notes_n_body ON notes (n, body)')
+        db.invalidate_metadata('notes')
+        assert frozenset({'n', 'body'}) in notes._get_unique_key_sets()
+        notes._prefix_index_names = {'ux_notes_n_body'}  # 模拟从 MySQL 反射到的前缀索引（dialect_options 带 mysql_length）
+        assert frozenset({'n', 'body'}) not in notes._get_unique_key_sets()
+        assert not notes._has_index(['n', 'body'], unique=True)
+        
+        auto_db = Database(f'sqlite:///{db_path}', auto_index=True)
+        assert auto_db['orders'].auto_index is True
+        auto_db.close()
+        
+        print("\n✅ 索引管理测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_get_many():
+    """测试批量键查询 get_many 和 IN 条件"""
+    print("\n" + "=" * 50)
+    print("测试批量键查询")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        stocks = db['stocks']
+        stocks.insert_many([{'code': f'{i:06d}', 'price': float(i), 'tags': ['a', i]} for i in range(3000)])
+        
+        from sqlalchemy import event
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        
+        wanted = [f'{i:06d}' for i in range(0, 3000, 2)] + ['999999', None, '000000']
+        result = stocks.get_many('code', wanted, chunk_size=500)
+        print(f"   get_many 查询 {len(wanted)} 个值，返回 {len(result)} 条，执行 {len(statements)} 条语句")
+        assert len(result) == 1500 and len(statements) == 4  # 去重后 1501 个值，每块 500 个
+        assert result['000004']['price'] == 4.0
+        assert '999999' not in result
+        assert stocks.get_many('no_such_column', ['x']) == {}
+        assert stocks.get_many('code', []) == {}
+        
+        # find / count / delete 的 list/tuple/set 值使用 IN
+        rows = stocks.find(code=['000001', '000003', 'none'], _order_by='-price')
+        assert [r['code'] for r in rows] == ['000003', '000001']
+        assert stocks.count(code=('000001', '000002'), price=1.0) == 1
+        assert stocks.find(code=[]) == []
+        assert stocks.find_one(id={5}, code=['000004'])['price'] == 4.0
+        assert [batch[:] for batch in stocks.scan(_batch_size=2, id=[1, 2, 3])][0][0]['id'] == 1
+        
+        # JSON 列的列表值仍然按等于处理，update 的 keys 也不会变成 IN
+        assert stocks.count(tags=['a', 1]) == 1
+        assert stocks.delete(code={'000010', '000011'}) == 2
+        assert stocks.count() == 2998
+        
+        print("\n✅ 批量键查询测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_read_cache():
+    """测试读缓存 cached(maxsize, ttl)"""
+    print("\n" + "=" * 50)
+    print("测试读缓存")
+    print("=" * 50)
+    
+    import time
+    from sqlalchemy import event
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        config = db['config']
+        config.insert_many([{'key': f'k{i}', 'value': i, 'tags': ['a']} for i in range(10)])
+        
+        cached = config.cached(maxsize=3, ttl=None)
+        assert config.cached(maxsize=3, ttl=None) is cached
+        
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        for _ in range(100):
+            assert cached.find_one(key='k1')['value'] == 1
+        assert len(statements) == 1
+        assert cached.stats()['hits'] == 99 and cached.stats()['misses'] == 1
+        
+        # 返回的是拷贝，修改结果不影响缓存
+        row = cached.find_one(key='k1')
+        row['value'] = 'changed'
+        assert cached.find_one(key='k1')['value'] == 1
+        
+        # IN 条件、排序、分页都是缓存键的一部分
+        assert [r['key'] for r in cached.find(key=['k1', 'k2'], _order_by='-value')] == ['k2', 'k1']
+        assert [r['key'] for r in cached.find(key=['k1', 'k2'], _order_by='value')] == ['k1', 'k2']
+        assert cached.stats()['evictions'] == 0
+        assert cached.count() == 10
+        assert cached.stats()['evictions'] == 1  # maxsize=3，淘汰最久未使用的
+        
+        # 本进程写入后自动失效，写操作可以直接通过缓存视图调用
+        cached.update({'key': 'k1', 'value': 100}, keys=['key'])
+        assert cached.find_one(key='k1')['value'] == 100
+        config.insert({'key': 'k10', 'value': 10})
+        assert cached.count() == 11
+        config.delete(key='k10')
+        assert cached.count() == 10
+        config.upsert({'key': 'k2', 'value': 200}, keys=['key'])
+        assert cached.find_one(key='k2')['value'] == 200
+        db.execute("UPDATE config SET value = 300 WHERE key = 'k3'")
+        assert cached.find_one(key='k3')['value'] == 300
+        db.query("UPDATE config SET value = 301 WHERE key = 'k3'")
+        assert cached.find_one(key='k3')['value'] == 301, "query 执行的增删改也应使缓存失效"
+        
+        # 删表后重建，已有的缓存视图不再返回删表前的数据
+        temp = db['cache_temp']
+        temp.insert({'a': 1})
+        temp_cached = temp.cached(maxsize=10, ttl=None)
+        assert [row['a'] for row in temp_cached.find()] == [1]
+        db.drop_table('cache_temp')
+        db['cache_temp'].insert({'a': 2})
+        assert [row['a'] for row in temp_cached.find()] == [2], "删表后缓存应失效"
+        
+        # 事务回滚后失效
+        try:
+            with db.transaction():
+                config.update({'key': 'k4', 'value': 400}, keys=['key'])
+                assert cached.find_one(key='k4')['value'] == 400
+                raise RuntimeError('rollback')
+        except RuntimeError:
+            pass
+        assert cached.find_one(key='k4')['value'] == 4
+        assert cached.stats()['invalidations'] >= 6
+        
+        # ttl 过期
+        short = config.cached(maxsize=10, ttl=0.05)
+        assert short.get_many('key', ['k5', 'k6'])['k6']['value'] == 6
+        short.get_many('key', ['k5', 'k6'])
+        time.sleep(0.1)
+        short.get_many('key', ['k5', 'k6'])
+        stats = short.stats()
+        print(f"   缓存统计: {stats}")
+        assert stats['hits'] == 1 and stats['misses'] == 2 and stats['expirations'] == 1
+        assert short.distinct('value', key=['k5', 'k6']) == [5, 6]
+        
+        print("\n✅ 读缓存测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_compact_rows():
+    """测试紧凑行 find(_as='tuple'|'row')"""
+    print("\n" + "=" * 50)
+    print("测试紧凑行")
+    print("=" * 50)
+    
+    import pickle
+    import tracemalloc
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        wide = db['wide']
+        wide.insert_many([{**{f'c{j}': i * j for j in range(20)}, 'count': i, 'class': 'x'} for i in range(2000)])
+        
+        rows = wide.find(_as='row', _order_by='id', _limit=3)
+        row = rows[0]
+        assert row.id == 1 and row['c3'] == 0 and row[0] == 1
+        assert row['class'] == 'x'  # 关键字列名只能按列名取
+        assert row.count == row['count'] == 0  # 同名列覆盖 tuple.count
+        assert row.get('no_such_column', 'default') == 'default'
+        assert row._asdict() == wide.find_one(id=1)
+        assert type(rows[1]) is type(row)  # 同一组列名只生成一次行类
+        assert not hasattr(row, '__dict__')
+        assert pickle.loads(pickle.dumps(row)) == row
+        print(f"   {row!r}"[:80])
+        
+        tuples = wide.find(_as='tuple', _limit=2)
+        assert tuples[1][:2] == (2, 0) and type(tuples[1]) is tuple
+        assert wide.find_one(_as='row', id=2).c2 == 2
+        assert [r.id for r in wide.find_iter(_as='row', _batch_size=500)][-1] == 2000
+        assert len(wide.all(_as='tuple')) == 2000
+        
+        cached = wide.cached()
+        assert cached.find(_as='row', id=[1, 2])[1].id == 2
+        assert cached.find_one(_as='row', id=1) == cached.find_one(_as='row', id=1)
+        
+        try:
+            wide.find(_as='json')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('不支持的 _as 应该抛出 ValueError')
+        
+        # 内存占用比字典小
+        sizes = {}
+        for as_ in ('dict', 'row'):
+            tracemalloc.start()
+            result = wide.find(_as=as_)
+            sizes[as_] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del result
+        print(f"   2000 行 x 23 列，dict: {sizes['dict'] // 1024} KB, row: {sizes['row'] // 1024} KB")
+        assert sizes['row'] < sizes['dict']
+        
+        print("\n✅ 紧凑行测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_metrics():
+    """测试运行指标 enable_metrics / stats"""
+    print("\n" + "=" * 50)
+    print("测试运行指标")
+    print("=" * 50)
+    
+    import threading
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        assert db.stats() == {'enabled': False}
+        assert db._metrics is None
+        
+        exported = []
+        exported_event = threading.Event()
+        
+        def exporter(stats):
+            exported.append(stats)
+            exported_event.set()
+        
+        db.enable_metrics(exporter=exporter, interval=0.05)
+        users = db['users']
+        users.insert({'name': 'a'})
+        users.insert_many([{'name': f'n{i}', 'age': i} for i in range(100)], chunk_size=30)
+        users.upsert({'name': 'a', 'age': 1}, keys=['name'])
+        users.find(age=[1, 2, 3])
+        users.find_one(name='a')
+        assert sum(1 for _ in users.find_iter(_batch_size=10)) == 101
+        assert users.count() == 101
+        try:
+            users.find(_as='bad')
+        except ValueError:
+            pass
+        
+        stats = db.stats()
+        table_stats = stats['tables']['users']
+        print(f"   users 的操作: {sorted(table_stats)}")
+        assert table_stats['insert']['count'] == 1 and table_stats['insert']['rows_in'] == 1
+        assert table_stats['insert_many']['count'] == 1 and table_stats['insert_many']['rows_in'] == 100
+        assert table_stats['find']['count'] == 3 and table_stats['find']['errors'] == 1
+        assert table_stats['find']['rows_out'] == 5  # age 为 1、2、3 的 4 条，加上 find_one 的 1 条
+        assert table_stats['find_iter']['rows_out'] == 101
+        assert table_stats['create_table']['count'] == 1
+        assert table_stats['alter']['count'] == 2  # name，之后 age
+        assert table_stats['upsert']['p99_ms'] is not None
+        assert sum(table_stats['count']['histogram'].values()) == 1
+        assert stats['rows_in'] == 102 and stats['rows_out'] == 106
+        assert stats['sql']['count'] > 0
+        assert stats['pool']['checkout_wait']['count'] > 0 and stats['pool']['checkout'] > 0
+        
+        assert exported_event.wait(5)
+        assert exported[0]['enabled'] is True
+        
+        # 公共方法内部调用其他公共方法时行数不能重复统计
+        logs = db['logs']
+        assert logs.bulk_load([{'n': i} for i in range(10)]) == 10
+        logs.upsert({'n': 100, 'v': 1}, keys=['n'])  # 不存在，插入
+        logs.upsert_many([{'n': 1, 'v': 2}, {'n': 101, 'v': 2}], keys=['n'])  # 没有唯一约束，逐条 upsert
+        logs_stats = db.stats()['tables']['logs']
+        print(f"   logs 的操作: {sorted(logs_stats)}")
+        assert logs_stats['bulk_load']['rows_in'] == 10
+        assert logs_stats['upsert']['count'] == 1 and logs_stats['upsert']['rows_in'] == 1
+        assert logs_stats['upsert_many']['rows_in'] == 2
+        assert 'insert_many' not in logs_stats and 'insert' not in logs_stats
+        
+        db.disable_metrics()
+        # 最后一次导出发生在清空指标之前，内容完整
+        assert exported[-1]['enabled'] is True
+        assert exported[-1]['tables']['logs']['upsert_many']['rows_in'] == 2
+        assert db.stats() == {'enabled': False}
+        users.insert({'name': 'b'})
+        assert db.enable_metrics().to_dict()['tables'] == {}
+        db.disable_metrics()
+        
+        # 默认的 sqlite:// 内存库使用 SingletonThreadPool，size 是整数属性而不是方法
+        with Database('sqlite://') as memory_db:
+            memory_db.enable_metrics()
+            memory_db['t'].insert({'a': 1})
+            pool_stats = memory_db.stats()['pool']
+            print(f"   sqlite:// 连接池: size={pool_stats.get('size')}")
+            assert isinstance(pool_stats['size'], int)
+        
+        print("\n✅ 运行指标测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
+def test_parallel_scan():
+    """测试按主键范围并行扫描 parallel_scan"""
+    print("\n" + "=" * 50)
+    print("测试并行扫描")
+    print("=" * 50)
+    
+    with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+        db_path = f.name
+    
+    db = None
+    try:
+        db = connect(f'sqlite:///{db_path}')
+        orders = db['orders']
+        orders.insert_many([{'amount': i, 'kind': i % 3} for i in range(5000)])
+        
+        def total(rows):
+            return sum(row['amount'] for row in rows)
+        
+        result = orders.parallel_scan(4, total, reduce=lambda a, b: a + b)
+        print(f"   4 个线程并行求和: {result}")
+        assert result == sum(range(5000))
+        
+        # 不合并时按主键顺序返回每一批的结果
+        sizes = orders.parallel_scan(3, len, batch_size=300)
+        assert sum(sizes) == 5000 and max(sizes) <= 300
+        first_ids = orders.parallel_scan(2, lambda rows: rows[0]['id'], partitions=5)
+        assert first_ids == sorted(first_ids)
+        
+        assert orders.parallel_scan(4, total, reduce=lambda a, b: a + b, filters={'kind': 1}) == \
+            sum(i for i in range(5000) if i % 3 == 1)
+        assert orders.parallel_scan(2, total, reduce=lambda a, b: a + b, filters={'kind': 9}) is None
+        
+        # 字符串主键按分位数切分
+        codes = db.create_table('codes', primary_id='code', primary_type='String', primary_increment=False)
+        codes.insert_many([{'code': f'c{i:04d}', 'amount': i} for i in range(1000)])
+        ranges = codes._split_key_ranges('code', 4, {})
+        print(f"   字符串主键切分: {ranges}")
+        assert len(ranges) == 4 and ranges[-1][2]
+        assert codes.parallel_scan(3, total, reduce=lambda a, b: a + b) == sum(range(1000))
+        
+        assert db['not_exists'].parallel_scan(2, total) == []
+        try:
+            orders.parallel_scan(2, total, mode='fiber')
+            assert False, 'mode 不合法应该报错'
+        except ValueError:
+            pass
+        
+        print("\n✅ 并行扫描测试通过！")
+        
+    finally:
+        if db is not None:
+            db.close()
+        if os.path.exists(db_path):
+            try:
+                os.remove(db_path)
+            except PermissionError:
+                pass
+
+
 if __name__ == '__main__':
     print("=" * 60)
     print("nb_db_dict 模块测试")
@@ -348,6 +1662,25 @@ if __name__ == '__main__':
     test_flyweight_pattern()
     test_get_table_helper()
     test_table_operations()
+    test_buffered_writer()
+    test_native_upsert()
+    test_find_iter()
+    test_scan()
+    test_batched_schema_evolution()
+    test_insert_many_chunked()
+    test_statement_cache()
+    test_transaction_scope()
+    test_metadata_cache()
+    test_columnar_fetch()
+    test_insert_columns()
+    test_bulk_load()
+    test_async_database()
+    test_index_management()
+    test_get_many()
+    test_read_cache()
+    test_compact_rows()
+    test_metrics()
+    test_parallel_scan()
     
     print("\n" + "=" * 60)
     print("🎉 所有测试通过！")